@@ -1,14 +1,19 @@
 """Модуль запуска FastAPI-приложения apifast."""
 
+import asyncio
+import logging
+import sys
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
 
 import asyncpg
 from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from src.deps import create_http_client, create_langgraph_client
 from src.routes.agent import router as agent_router
 from src.routes.health import router as health_router
 from src.routes.reminders import reminders_router
@@ -31,8 +36,11 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
         min_size=settings.postgres_pool_min_size,
         max_size=settings.postgres_pool_max_size,
         command_timeout=settings.postgres_command_timeout,
+        statement_cache_size=settings.postgres_statement_cache_size,
     )
     app.state.pg_pool = pool
+    app.state.lg_client = create_langgraph_client()
+    app.state.http_client = create_http_client()
     logger.info(
         "app.started",
         pg_pool_min=settings.postgres_pool_min_size,
@@ -41,29 +49,179 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     try:
         yield
     finally:
+        await app.state.http_client.aclose()
+        await app.state.lg_client.aclose()
         await pool.close()
+        # qdrant_common импортируется лениво (только при обновлениях) — не
+        # загружаем его ради остановки, если пул BM25 не мог быть создан
+        qdrant_common = sys.modules.get("src.update.qdrant_common")
+        if qdrant_common is not None:
+            await asyncio.to_thread(qdrant_common.shutdown_bm25_executor)
         logger.info("app.stopped")
 
 
-app = FastAPI(title="FastAPI ↔ LangGraph", debug=True, lifespan=lifespan)
+class ValidationBodyCapture:
+    """ASGI-middleware: сохраняет тело запроса в scope["state"]["raw_body"].
+
+    Тело накапливается по мере чтения приложением, поэтому обработчику 422
+    не нужно повторно буферизовать его через `await request.body()`.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        """Сохраняет вложенное ASGI-приложение."""
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Оборачивает receive для захвата тела http-запроса."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        chunks: list[bytes] = []
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    state["raw_body"] = b"".join(chunks)
+            return message
+
+        await self.app(scope, receive_wrapper, send)
+
+
+class FastCORS:
+    """ASGI-middleware CORS: любые методы и заголовки, origin — из списка.
+
+    Повторяет поведение CORSMiddleware для конфигурации сервиса
+    (allow_methods=["*"], allow_headers=["*"], без credentials), но проверяет
+    origin по frozenset и дописывает заголовки прямо в http.response.start.
+    """
+
+    ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+    MAX_AGE = b"600"
+
+    def __init__(self, app: ASGIApp, origins: list[str]) -> None:
+        """Сохраняет приложение и предвычисляет множество разрешённых origin."""
+        self.app = app
+        self.origins = frozenset(o.encode("latin-1") for o in origins)
+        self.allow_all = b"*" in self.origins
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Обрабатывает preflight и добавляет CORS-заголовки к ответам."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin: bytes | None = None
+        request_method: bytes | None = None
+        request_headers: bytes | None = None
+        has_cookie = False
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+            elif name == b"cookie":
+                has_cookie = True
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed = self.allow_all or origin in self.origins
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight(send, origin, allowed, request_headers)
+            return
+
+        if not allowed:
+            await self.app(scope, receive, send)
+            return
+
+        explicit = not self.allow_all or has_cookie
+        cors_headers = (
+            [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+            if explicit
+            else [(b"access-control-allow-origin", b"*")]
+        )
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _preflight(
+        self,
+        send: Send,
+        origin: bytes,
+        allowed: bool,
+        request_headers: bytes | None,
+    ) -> None:
+        """Отвечает на preflight-запрос без вызова приложения."""
+        if not allowed:
+            body = b"Disallowed CORS origin"
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 400,
+                    "headers": [
+                        (b"content-type", b"text/plain; charset=utf-8"),
+                        (b"content-length", str(len(body)).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        headers = [
+            (b"access-control-allow-origin", b"*" if self.allow_all else origin),
+            (b"access-control-allow-methods", self.ALLOW_METHODS),
+            (b"access-control-max-age", self.MAX_AGE),
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", b"2"),
+        ]
+        if request_headers:
+            headers.append((b"access-control-allow-headers", request_headers))
+        if not self.allow_all:
+            headers.append((b"vary", b"Origin"))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"OK"})
+
+
+app = FastAPI(
+    title="FastAPI ↔ LangGraph",
+    debug=True,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(
     request: Request, exc: RequestValidationError
-) -> JSONResponse:
+) -> ORJSONResponse:
     """Обработчик ошибок валидации."""
-    body = await request.body()
-    logger.error("validation.error", errors=exc.errors(), body=body.decode())
-    return JSONResponse(status_code=422, content={"detail": exc.errors()})
+    # jsonable_encoder — как в стандартном обработчике FastAPI: в ctx бывают
+    # объекты исключений, которые orjson не сериализует.
+    errors = jsonable_encoder(exc.errors())
+    if logger.isEnabledFor(logging.ERROR):
+        body: bytes = request.scope.get("state", {}).get("raw_body", b"")
+        logger.error(
+            "validation.error",
+            errors=errors,
+            body=body.decode(errors="replace"),
+        )
+    return ORJSONResponse(status_code=422, content={"detail": errors})
 
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.cors_origins,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(ValidationBodyCapture)
+app.add_middleware(FastCORS, origins=settings.cors_origins)
 app.include_router(agent_router)
 app.include_router(reminders_router)
 app.include_router(update_faq_router)
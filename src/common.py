@@ -2,22 +2,30 @@
 
 import asyncio
 import random
+import time
+from collections import OrderedDict
 from functools import wraps
 
-from typing_extensions import Any, Awaitable, Callable, TypeVar
+from typing_extensions import Any, AsyncIterator, Awaitable, Callable, Generic, Hashable, TypeVar
 
 from .zena_logging import get_logger
 
 T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
 
 logger = get_logger()
 
+_sleep = asyncio.sleep
+_rand = random.uniform
+
 
 def retry_async(
     retries: int = 3,
     backoff: float = 2.0,
     jitter: float = 1.0,
     exceptions: tuple[type[Exception], ...] = (Exception,),
+    max_delay: float = 30.0,
 ) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
     """Декоратор для асинхронных ретраев с экспоненциальным бэкоффом и равномерным джиттером.
 
@@ -26,36 +34,113 @@ def retry_async(
         backoff: базовый коэффициент экспоненты (например, 2.0 => 2^attempt)
         jitter: амплитуда добавочного шума [0, jitter)
         exceptions: кортеж типов исключений, которые нужно ретраить
+        max_delay: потолок паузы между попытками в секундах (по умолчанию 30)
     """
 
     def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        # Всё, что не меняется между вызовами, вычисляется один раз при декорировании
+        name = func.__name__
+        sleep = _sleep
+        rand = _rand
+
         @wraps(func)
         async def wrapper(*args: Any, **kwargs: Any) -> T:
-            log = get_logger()
             for attempt in range(1, retries + 1):
                 try:
                     return await func(*args, **kwargs)
                 except exceptions as e:
                     if attempt == retries:
-                        log.exception(
+                        logger.exception(
                             "retry.exhausted",
-                            func=func.__name__,
+                            func=name,
                             error=str(e),
                         )
                         raise
-                    wait = (backoff**attempt) + random.uniform(0, jitter)
-                    log.warning(
+                    wait = min(backoff**attempt + rand(0, jitter), max_delay)
+                    logger.warning(
                         "retry.attempt",
-                        func=func.__name__,
+                        func=name,
                         error=str(e),
                         attempt=attempt,
                         retries=retries,
                         wait_sec=round(wait, 1),
                     )
-                    await asyncio.sleep(wait)
+                    await sleep(wait)
 
-            raise RuntimeError(f"{func.__name__}: исчерпаны все попытки")
+            raise RuntimeError(f"{name}: исчерпаны все попытки")
 
         return wrapper
 
     return decorator
+
+
+class TTLCache(Generic[K, V]):
+    """Простой in-process LRU-кэш с временем жизни записей.
+
+    Операции синхронные, поэтому в пределах одного event loop не требуют блокировок.
+
+    Args:
+        maxsize: максимальное число записей (вытесняются самые старые по использованию)
+        ttl: время жизни записи в секундах
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """Создаёт пустой кэш."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        """Возвращает значение или None, если записи нет или она устарела."""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        """Сохраняет значение, вытесняя самую давнюю запись при переполнении."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        """Удаляет запись, если она есть."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Очищает кэш."""
+        self._data.clear()
+
+
+async def gather_or_cancel(*aws: Awaitable[T]) -> list[T]:
+    """asyncio.gather, который при ошибке одной задачи отменяет остальные.
+
+    Обычный gather оставляет соседние задачи работать после исключения —
+    для этапов одного пайплайна это бессмысленная нагрузка на внешние сервисы.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # Дожидаемся отмены: соседние задачи не должны работать после выхода
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def prepend_async(first: T, rest: AsyncIterator[T]) -> AsyncIterator[T]:
+    """Возвращает уже прочитанный первый элемент обратно в начало async-итератора.
+
+    Нужен, когда первый элемент потока читается заранее — например, чтобы
+    проверить, что поток не пуст.
+    """
+    yield first
+    async for item in rest:
+        yield item
@@ -1,11 +1,11 @@
-"""Модуль получения контекстного менеджера langgraph-api."""
+"""Модуль зависимостей FastAPI: клиент langgraph-api и пул postgres."""
 
-from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+import os
 
 import asyncpg
+import httpx
+import langgraph_sdk
 from fastapi import Request
-from langgraph_sdk import get_client
 from langgraph_sdk.client import LangGraphClient
 
 from .settings import settings
@@ -13,16 +13,66 @@ from .zena_logging import get_logger
 
 logger = get_logger()
 
-@asynccontextmanager
-async def langgraph_client() -> AsyncGenerator[LangGraphClient, None]:
-    """Определение контекстного менеджера."""
-    client = get_client(url=settings.langgraph_url)
-    try:
-        yield client
-    finally:
-        await client.aclose()
+# Пул keep-alive соединений к langgraph-api (HTTP/2 мультиплексирует запросы).
+LANGGRAPH_HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=100,
+    max_connections=200,
+    keepalive_expiry=30.0,
+)
+# Таймауты как у langgraph_sdk.get_client: долгий read для runs.join.
+LANGGRAPH_HTTP_TIMEOUT = httpx.Timeout(connect=5, read=300, write=300, pool=5)
+LANGGRAPH_HTTP_RETRIES = 3
+# Откуда langgraph_sdk.get_client берёт API-ключ (в порядке приоритета)
+LANGGRAPH_API_KEY_ENVS = ("LANGGRAPH_API_KEY", "LANGSMITH_API_KEY", "LANGCHAIN_API_KEY")
+
+
+def _langgraph_headers() -> dict[str, str]:
+    """Заголовки, которые выставил бы langgraph_sdk.get_client: User-Agent и x-api-key."""
+    headers = {"User-Agent": f"langgraph-sdk-py/{langgraph_sdk.__version__}"}
+    for env in LANGGRAPH_API_KEY_ENVS:
+        if api_key := os.getenv(env):
+            headers["x-api-key"] = api_key.strip().strip('"').strip("'")
+            break
+    return headers
+
+
+def create_langgraph_client() -> LangGraphClient:
+    """Создаёт клиент langgraph-api поверх пула httpx-соединений.
+
+    Вызывается один раз в lifespan приложения.
+    """
+    transport = httpx.AsyncHTTPTransport(
+        retries=LANGGRAPH_HTTP_RETRIES,
+        http2=True,
+        limits=LANGGRAPH_HTTP_LIMITS,
+    )
+    http_client = httpx.AsyncClient(
+        base_url=settings.langgraph_url,
+        transport=transport,
+        timeout=LANGGRAPH_HTTP_TIMEOUT,
+        headers=_langgraph_headers(),
+    )
+    return LangGraphClient(http_client)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Создаёт общий httpx-клиент для служебных запросов (например, health-check)."""
+    return httpx.AsyncClient(
+        timeout=5.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+
+
+def langgraph_client(request: Request) -> LangGraphClient:
+    """Достаёт общий клиент langgraph-api из app.state."""
+    return request.app.state.lg_client
 
 
 def get_pg_pool(request: Request) -> asyncpg.Pool:  # type: ignore[type-arg]
     """Достаёт пул из app.state."""
     return request.app.state.pg_pool
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """Достаёт общий httpx-клиент из app.state."""
+    return request.app.state.http_client
@@ -32,7 +32,10 @@ async def sent_message_to_history(
     dialog_state: str,
     dialog_state_new: str,
 ) -> dict[str, Any]:
-    """Отправка переменных на endpoint для сохранения с повтором при ошибках."""
+    """Отправка переменных на endpoint для сохранения с повтором при ошибках.
+
+    Параллелизм ограничивает вызывающий код (см. REMINDERS_MAX_PARALLEL в reminders).
+    """
     return await retry_async(
         _sent_message_to_history,
         user_id,
@@ -0,0 +1,8 @@
+"""Общие построители ответов для endpoint-ов обновления."""
+
+from fastapi.responses import ORJSONResponse
+
+
+def fail(message: str, status_code: int) -> ORJSONResponse:
+    """Ответ об ошибке в едином формате {"success": False, "exception": ...}."""
+    return ORJSONResponse(content={"success": False, "exception": message}, status_code=status_code)
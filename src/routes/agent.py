@@ -1,14 +1,20 @@
 """Модуль создания endpointa '/agent/run' - агента-бота."""
 
+import asyncio
+import logging
 import time
+from collections.abc import Mapping
 from datetime import datetime, timezone
-from typing import Any
+from types import MappingProxyType
+from typing import Any, Final
 
-from fastapi import APIRouter, status
-from fastapi.responses import JSONResponse
+import httpx
+from fastapi import APIRouter, Depends, status
+from fastapi.responses import ORJSONResponse
 from langgraph_sdk.client import LangGraphClient
 from langgraph_sdk.schema import Assistant
 
+from ..common import TTLCache  # type: ignore
 from ..deps import langgraph_client  # type: ignore
 from ..schemas import AgentRunParams  # type: ignore
 from ..zena_logging import bind_contextvars, clear_contextvars, get_logger, timed_block
@@ -17,46 +23,116 @@ logger = get_logger()
 
 router = APIRouter(prefix="/agent", tags=["agent"])
 
+# Команды сброса диалога (сравниваются после strip().lower())
+_STOP_WORDS = frozenset({"стоп"})
+# Сообщения длиннее этого порога заведомо не команда — не нормализуем их
+_STOP_WORD_MAX_LEN = 16
+
+# Начальные metadata нового thread (без None, чтобы не отбрасывалось)
+_THREAD_INIT_METADATA: Final[Mapping[str, Any]] = MappingProxyType(
+    {
+        "last_user_ts": "",
+        "last_assistant_ts": "",
+        "last_reminder_ts": "",
+        "last_dialog_state": "",
+        "reminded": 0,
+        "ready_for_reminder": 0,
+    }
+)
+
+# user_companychat -> thread_id последнего диалога (экономит threads.search)
+THREAD_CACHE_MAXSIZE = 10_000
+THREAD_CACHE_TTL_SEC = 600
+_thread_cache: TTLCache[str, str] = TTLCache(THREAD_CACHE_MAXSIZE, THREAD_CACHE_TTL_SEC)
+
+# user_companychat -> assistant_id (экономит assistants.search)
+ASSISTANT_CACHE_MAXSIZE = 50_000
+ASSISTANT_CACHE_TTL_SEC = 3600
+_assistant_cache: TTLCache[str, str] = TTLCache(
+    ASSISTANT_CACHE_MAXSIZE, ASSISTANT_CACHE_TTL_SEC
+)
+
 
 # -----------------------------
 # Helpers
 # -----------------------------
 
+# Кэш последней отформатированной метки времени (обновляется не чаще раза в 1 мс)
+_last_ts_ns = 0
+_last_ts_str = ""
+
+
 def _utc_iso() -> str:
-    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    """Возвращает текущее UTC-время в ISO-формате с суффиксом Z."""
+    global _last_ts_ns, _last_ts_str
+    now = time.time_ns()
+    if now - _last_ts_ns < 1_000_000:
+        return _last_ts_str
+    _last_ts_str = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    _last_ts_ns = now
+    return _last_ts_str
 
 
 def _content_to_text(content: str | list[Any] | dict | None) -> str:
-    """Нормализует content в строку (учитывает особенности LangGraph Studio)."""
-    if isinstance(content, str):
-        return content
-
-    if isinstance(content, list) and content:
-        part = content[0]
-        if isinstance(part, dict):
-            txt = part.get("text")
-            if isinstance(txt, str):
+    """Нормализует content в строку (учитывает особенности LangGraph Studio).
+
+    Принимает как сам content, так и сообщение целиком (dict с ключом "content").
+    Самый частый случай — строка — проверяется первым.
+    """
+    t = type(content)
+    if t is str:
+        return content  # type: ignore[return-value]
+
+    if t is list:
+        if not content:
+            return ""
+        part = content[0]  # type: ignore[index]
+        if type(part) is dict:
+            get = part.get
+            txt = get("text")
+            if type(txt) is str:
                 return txt
-            cnt = part.get("content")
-            if isinstance(cnt, str):
+            cnt = get("content")
+            if type(cnt) is str:
                 return cnt
+        return ""
 
-    if isinstance(content, dict) and content:
-        cnt = content.get("content")
-        if isinstance(cnt, str):
+    if t is dict:
+        cnt = content.get("content")  # type: ignore[union-attr]
+        if type(cnt) is str:
             return cnt
+        if type(cnt) is list:
+            return _content_to_text(cnt)
 
     return ""
 
 
+def _is_stop_command(message: str | None) -> bool:
+    """Проверяет, что сообщение — команда сброса диалога."""
+    if not message or len(message) > _STOP_WORD_MAX_LEN:
+        return False
+    return message.strip().lower() in _STOP_WORDS
+
+
+def _is_not_found(exc: BaseException) -> bool:
+    """Проверяет, что langgraph-api ответил 404 (ресурс удалён)."""
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 404
+
+
 async def _patch_thread_metadata(
     client: LangGraphClient,
     thread_id: str,
     patch: dict[str, Any],
+    extra: dict[str, Any] | None = None,
 ) -> None:
     """
     Обновление метаданных threads.
+
+    extra (например, реквизиты доставки) дописывается в patch на месте,
+    без построения промежуточного словаря.
     """
+    if extra:
+        patch.update(extra)
     if hasattr(client.threads, "update"):
         await client.threads.update(thread_id=thread_id, metadata=patch)
         return
@@ -77,9 +153,9 @@ async def _patch_user_meta(
         {
             "user_companychat": user_companychat,
             "last_user_ts": _utc_iso(),
-            **delivery,
-
+            "ready_for_reminder": 0,
         },
+        delivery,
     )
 
 
@@ -98,93 +174,138 @@ async def _patch_assistant_meta(
             "last_assistant_ts": _utc_iso(),
             "last_dialog_state": dialog_state or 'new',
             "reminded": 0, # обнуление счетчика возобновления диалога после ответа агента.
-            **delivery,
+            # последним ответил ассистент — thread попадает в выборку reminders/check
+            "ready_for_reminder": 1,
         },
+        delivery,
     )
 
+
+async def _run_agent(
+    client: LangGraphClient,
+    params: AgentRunParams,
+    user_message: str,
+    delivery: dict[str, Any],
+    request_id: str,
+    refresh: bool = False,
+) -> str:
+    """Находит assistant/thread, запускает run и возвращает текст ответа агента."""
+    user_companychat = str(params.user_companychat)
+    assistant_id, thread_id = await get_assistant_and_thread(client, params, refresh)
+
+    # Инжектим request_id для сквозной трассировки
+    if params.context is None:
+        params.context = {}
+    params.context["_request_id"] = request_id
+
+    # 1) фиксируем вход пользователя параллельно с запуском run
+    patch_task = asyncio.create_task(
+        _patch_user_meta(client, thread_id, user_companychat, delivery)
+    )
+    try:
+        run = await client.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            input={"messages": [{"role": "user", "content": user_message}]},
+            config=params.config,
+            context=params.context,
+            metadata=params.metadata,
+            on_completion="delete",
+        )
+
+        agent_response = await client.runs.join(
+            thread_id=run["thread_id"],
+            run_id=run["run_id"],
+        )
+    finally:
+        try:
+            await patch_task
+        except Exception as e:
+            logger.warning("thread.patch_failed", thread_id=thread_id, patch="last_user_ts", error=str(e))
+
+    msgs = agent_response.get("messages")
+    text = _content_to_text(msgs[-1])
+    dialog_state = agent_response.get("data", {}).get("dialog_state")
+
+    # 2) фиксируем время ответа ассистента и статус диалога
+    try:
+        await _patch_assistant_meta(client, thread_id, user_companychat, dialog_state, delivery)
+    except Exception as e:
+        logger.warning("thread.patch_failed", thread_id=thread_id, patch="last_assistant_ts", error=str(e))
+
+    logger.info("agent.run.messages", message_in=user_message, message_out=text)
+    return text
+
+
 # -----------------------------
 # Endpoint
 # -----------------------------
 
 @router.post("/run")
-async def run_sync(params: AgentRunParams) -> JSONResponse:
+async def run_sync(
+    params: AgentRunParams,
+    client: LangGraphClient = Depends(langgraph_client),
+) -> ORJSONResponse:
     text = ""
+    # Типы полей уже проверены AgentRunParams — приведение не требуется
     delivery = {
-        "delivery_user_id": int(params.user_id),
-        "delivery_reply_to_history_id": int(params.reply_to_history_id),
-        "delivery_access_token": str(params.access_token),
+        "delivery_user_id": params.user_id,
+        "delivery_reply_to_history_id": params.reply_to_history_id,
+        "delivery_access_token": params.access_token,
     }
-    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
-    success_response: dict[str, Any] = {"success": False, "exception": "unknown"}
+    # Оба значения присваиваются на каждом пути ниже — заглушки не создаём
+    status_code: int
+    success_response: dict[str, Any]
 
     user_companychat = str(params.user_companychat)
     request_id = f"{user_companychat}:{int(time.time())}"
     clear_contextvars()
     bind_contextvars(user_cc=user_companychat, request_id=request_id)
 
+    # Пустое сообщение отклоняем до замера времени — это не полноценный запуск
+    user_message = (params.message or "").strip()
+    if not user_message:
+        logger.info("agent.run.rejected", reason="empty message")
+        return ORJSONResponse(
+            content={"success": False, "exception": "empty message"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
     try:
         async with timed_block("agent.run"):
-            logger.info("agent.run.started", assistant_id=params.assistant_id)
-            logger.debug("agent.run.params", params=str(params))
-
-            user_message = (params.message or "").strip()
-
-            if not user_message:
-                success_response = {"success": False, "exception": "empty message"}
-                return JSONResponse(content=success_response, status_code=status.HTTP_400_BAD_REQUEST)
-
-            async with langgraph_client() as client:
-                assistant_id = await get_or_create_assistant(client, params)
-                thread_id = await get_or_create_thread(client, assistant_id, params)
-
-                # 1) фиксируем вход пользователя
-                try:
-                    await _patch_user_meta(client, thread_id, user_companychat, delivery)
-                except Exception as e:
-                    logger.warning("thread.patch_failed", thread_id=thread_id, patch="last_user_ts", error=str(e))
-
-                # Инжектим request_id для сквозной трассировки
-                if params.context is None:
-                    params.context = {}
-                params.context["_request_id"] = request_id
-
-                run = await client.runs.create(
-                    thread_id=thread_id,
-                    assistant_id=assistant_id,
-                    input={"messages": [{"role": "user", "content": user_message}]},
-                    config=params.config,
-                    context=params.context,
-                    metadata=params.metadata,
-                    on_completion="delete",
-                )
-
-                agent_response = await client.runs.join(
-                    thread_id=run["thread_id"],
-                    run_id=run["run_id"],
+            logger.info(
+                "agent.run.started",
+                assistant_id=params.assistant_id,
+                message_len=len(params.message or ""),
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("agent.run.params", params=str(params))
+
+            try:
+                text = await _run_agent(client, params, user_message, delivery, request_id)
+            except Exception as e:
+                if not _is_not_found(e):
+                    raise
+                # Закэшированный thread/assistant удалён на стороне langgraph
+                # (например, другим воркером по "стоп") — ищем заново и повторяем один раз
+                logger.warning("agent.run.stale_ids", error=str(e))
+                text = await _run_agent(
+                    client, params, user_message, delivery, request_id, refresh=True
                 )
 
-                msgs = agent_response.get("messages")
-                text = _content_to_text(msgs[-1])
-                dialog_state = agent_response.get("data", {}).get("dialog_state")
-
-                # 2) фиксируем время ответа ассистента и статус диалога
-                try:
-                    await _patch_assistant_meta(client, thread_id, user_companychat, dialog_state, delivery)
-                except Exception as e:
-                    logger.warning("thread.patch_failed", thread_id=thread_id, patch="last_assistant_ts", error=str(e))
-
-            logger.info("agent.run.message_in", message=user_message)
-            logger.info("agent.run.message_out", message=text)
-
             success_response = {"success": True, "exception": "no", "message": text}
             status_code = status.HTTP_200_OK
 
     except Exception as e:
         logger.exception("agent.run.failed", error=str(e))
+        # 404 и после повторного поиска — следующий запрос тоже начнёт с чистого поиска
+        if _is_not_found(e):
+            _thread_cache.pop(user_companychat)
+            _assistant_cache.pop(user_companychat)
         success_response = {"success": False, "exception": str(e)}
         status_code = status.HTTP_503_SERVICE_UNAVAILABLE
 
-    return JSONResponse(content=success_response, status_code=status_code)
+    return ORJSONResponse(content=success_response, status_code=status_code)
 
 
 # -----------------------------
@@ -194,12 +315,17 @@ async def run_sync(params: AgentRunParams) -> JSONResponse:
 async def get_or_create_assistant(client: LangGraphClient, params: AgentRunParams) -> str:
     user_companychat = str(params.user_companychat)
 
+    cached_assistant_id = _assistant_cache.get(user_companychat)
+    if cached_assistant_id:
+        return cached_assistant_id
+
     assistants: list[Assistant] = await client.assistants.search(
         metadata={"user_companychat": user_companychat}
     )
 
     if assistants:
         logger.info("assistant.found", assistant_id=assistants[0]["assistant_id"])
+        _assistant_cache.set(user_companychat, assistants[0]["assistant_id"])
         return assistants[0]["assistant_id"]
 
     assistant: Assistant = await client.assistants.create(
@@ -209,31 +335,70 @@ async def get_or_create_assistant(client: LangGraphClient, params: AgentRunParam
         metadata={"user_companychat": user_companychat},
     )
     logger.info("assistant.created", assistant_id=assistant["assistant_id"])
+    _assistant_cache.set(user_companychat, assistant["assistant_id"])
     return assistant["assistant_id"]
 
 
-async def get_or_create_thread(client: LangGraphClient, assistant_id: str, params: AgentRunParams) -> str:
-    last_message = (params.message or "").strip().lower()
+async def get_assistant_and_thread(
+    client: LangGraphClient, params: AgentRunParams, refresh: bool = False
+) -> tuple[str, str]:
+    """Параллельно находит ассистента и последний thread пользователя.
+
+    Поиск ассистента и поиск thread-а не зависят друг от друга, поэтому
+    выполняются одним `asyncio.gather`. По команде "стоп" вместо поиска
+    старые threads удаляются и создаётся новый.
+
+    refresh=True сбрасывает закэшированные id и ищет их в langgraph заново:
+    кэш у каждого воркера свой, и id в нём может быть уже удалён другим
+    воркером (например, по команде "стоп").
+    """
     user_companychat = str(params.user_companychat)
 
-    if last_message == "стоп":
+    if refresh:
+        _thread_cache.pop(user_companychat)
+        _assistant_cache.pop(user_companychat)
+
+    if _is_stop_command(params.message):
         logger.info("dialog.stop_command", user_cc=user_companychat)
-        await _delete_thread(client, user_companychat)
-        return await _create_thread(client, assistant_id, params)
+        _thread_cache.pop(user_companychat)
+        assistant_id, _ = await asyncio.gather(
+            get_or_create_assistant(client, params),
+            _delete_thread(client, user_companychat),
+        )
+        return assistant_id, await _create_thread(client, assistant_id, params)
+
+    cached_thread_id = _thread_cache.get(user_companychat)
+    if cached_thread_id:
+        logger.info("thread.cached", thread_id=cached_thread_id)
+        return await get_or_create_assistant(client, params), cached_thread_id
+
+    assistant_id, thread_id = await asyncio.gather(
+        get_or_create_assistant(client, params),
+        _find_thread(client, user_companychat),
+    )
+
+    if thread_id:
+        return assistant_id, thread_id
+
+    logger.info("thread.creating", user_cc=user_companychat)
+    return assistant_id, await _create_thread(client, assistant_id, params)
 
+
+async def _find_thread(client: LangGraphClient, user_companychat: str) -> str | None:
+    """Ищет последний thread пользователя; найденный id кладёт в кэш."""
     threads = await client.threads.search(
         metadata={"user_companychat": user_companychat},
         sort_by="created_at",
         sort_order="desc",
         limit=1,
     )
+    if not threads:
+        return None
 
-    if threads:
-        logger.info("thread.found", thread_id=threads[0]["thread_id"])
-        return threads[0]["thread_id"]
-
-    logger.info("thread.creating", user_cc=user_companychat)
-    return await _create_thread(client, assistant_id, params)
+    thread_id: str = threads[0]["thread_id"]
+    logger.info("thread.found", thread_id=thread_id)
+    _thread_cache.set(user_companychat, thread_id)
+    return thread_id
 
 
 async def _delete_thread(client: LangGraphClient, user_companychat: str) -> None:
@@ -242,8 +407,13 @@ async def _delete_thread(client: LangGraphClient, user_companychat: str) -> None
         sort_by="created_at",
         sort_order="desc",
     )
-    for thread in threads:
-        await client.threads.delete(thread_id=thread["thread_id"])
+    results = await asyncio.gather(
+        *(client.threads.delete(thread_id=t["thread_id"]) for t in threads),
+        return_exceptions=True,
+    )
+    for thread, res in zip(threads, results):
+        if isinstance(res, BaseException):
+            logger.warning("thread.delete_failed", thread_id=thread["thread_id"], error=str(res))
     logger.info("thread.old_deleted", count=len(threads))
 
 
@@ -251,21 +421,16 @@ async def _create_thread(client: LangGraphClient, assistant_id: str, params: Age
     thread = await client.threads.create(
         graph_id=assistant_id,
         metadata={
+            **_THREAD_INIT_METADATA,
             "user_companychat": str(params.user_companychat),
 
-            # init (без None, чтобы не отбрасывалось)
-            "last_user_ts": "",
-            "last_assistant_ts": "",
-            "last_reminder_ts": "",
-            "last_dialog_state": "",
-            "reminded": 0,
-
             # реквизиты доставки
-            "delivery_user_id": int(params.user_id),
-            "delivery_reply_to_history_id": int(params.reply_to_history_id),
-            "delivery_access_token": str(params.access_token),
+            "delivery_user_id": params.user_id,
+            "delivery_reply_to_history_id": params.reply_to_history_id,
+            "delivery_access_token": params.access_token,
         },
     )
 
     logger.info("thread.created", thread_id=thread["thread_id"])
+    _thread_cache.set(str(params.user_companychat), thread["thread_id"])
     return thread["thread_id"]
\ No newline at end of file
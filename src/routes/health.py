@@ -1,25 +1,30 @@
 """Модуль реализует endpoint health/ok. Проверка работы langgraph-api."""
 
-from typing import Any
-
 import httpx
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
 
+from ..deps import get_http_client
 from ..settings import settings  # type: ignore
 
 router = APIRouter(prefix="/health", tags=["health"])
 
+# settings неизменны в рамках процесса — URL и параметры собираем один раз
+_OK_URL = f"{settings.langgraph_url.rstrip('/')}/ok"
+_OK_PARAMS = ({"check_db": 0}, {"check_db": 1})
+
 
 @router.get("/ok")
-async def ok(check_db: int = Query(0, ge=0, le=1)) -> dict[str, Any]:
+async def ok(
+    check_db: int = Query(0, ge=0, le=1),
+    client: httpx.AsyncClient = Depends(get_http_client),
+) -> ORJSONResponse:
     """Проверка работы langgraph-api."""
-    url = f"{settings.langgraph_url.rstrip('/')}/ok"
-    params = {"check_db": check_db}
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            return r.json()
+        r = await client.get(_OK_URL, params=_OK_PARAMS[check_db])
+        r.raise_for_status()
+        # Готовый ответ минует jsonable_encoder и валидацию response_model
+        return ORJSONResponse(content=r.json())
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
     except Exception as e:
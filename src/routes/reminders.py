@@ -1,8 +1,10 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 from typing import Any
 
-from fastapi import APIRouter, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, status
+from fastapi.responses import ORJSONResponse
+from langgraph_sdk.client import LangGraphClient
 
 from ..deps import langgraph_client  # type: ignore
 from ..requests.httpservice import sent_message_to_history  # type: ignore
@@ -14,6 +16,13 @@ logger = get_logger()
 DEFAULT_TIMEOUT_MINUTES = 5
 DEFAULT_COOLDOWN_MINUTES = 5
 DEFAULT_REMINDER_LIMIT = 2
+REMINDERS_MAX_PARALLEL = 10
+REMINDERS_PAGE_SIZE = 500
+
+# Threads, созданные до появления флага ready_for_reminder, его не имеют и в
+# поиск по metadata не попадают. Один раз на процесс проставляем им флаг по
+# last_assistant_ts/last_user_ts (см. _backfill_ready_flags)
+_ready_flags_backfilled = False
 
 reminders_router = APIRouter(prefix="/agent/reminders", tags=["reminders"])
 
@@ -21,16 +30,21 @@ reminders_router = APIRouter(prefix="/agent/reminders", tags=["reminders"])
 def _parse_iso(s: str | None) -> datetime | None:
     if not s:
         return None
+    # Python 3.11+ разбирает суффикс "Z" сам — replace не нужен
     try:
-        return datetime.fromisoformat(s.replace("Z", "+00:00"))
-    except Exception:
+        return datetime.fromisoformat(s)
+    except (TypeError, ValueError):
         return None
 
 
 def _safe_int(v: Any, default: int = 0) -> int:
+    if type(v) is int:
+        return v
+    if v is None:
+        return default
     try:
         return int(v)
-    except Exception:
+    except (TypeError, ValueError):
         return default
 
 
@@ -54,17 +68,162 @@ def _extract_reminder_text(agent_resp: Any) -> str:
     if not isinstance(msgs, list) or not msgs:
         return ""
 
-    last_msg = msgs[-1]
-    # Частый формат: dict с полем content
-    if isinstance(last_msg, dict) and "content" in last_msg:
-        return _content_to_text(last_msg["content"]).strip()
+    return _content_to_text(msgs[-1]).strip()
+
 
-    # fallback
-    return _content_to_text(last_msg).strip()
+async def _backfill_ready_flags(client: LangGraphClient) -> int:
+    """Проставляет ready_for_reminder threads, у которых его ещё нет.
+
+    Флаг = 1, если последним ответил ассистент (last_assistant_ts > last_user_ts),
+    иначе 0. Выполняется один раз на процесс; возвращает число обновлённых threads.
+    """
+    global _ready_flags_backfilled
+    if _ready_flags_backfilled:
+        return 0
+
+    updated = 0
+    offset = 0
+    while True:
+        page = await client.threads.search(
+            sort_by="created_at",
+            sort_order="desc",
+            limit=REMINDERS_PAGE_SIZE,
+            offset=offset,
+        )
+        for th in page:
+            md = th.get("metadata") or {}
+            if "ready_for_reminder" in md or not md.get("user_companychat"):
+                continue
+            last_assistant_ts = _parse_iso(md.get("last_assistant_ts"))
+            last_user_ts = _parse_iso(md.get("last_user_ts"))
+            ready = bool(
+                last_assistant_ts and (not last_user_ts or last_assistant_ts > last_user_ts)
+            )
+            await _patch_thread_metadata(
+                client, th["thread_id"], {"ready_for_reminder": int(ready)}
+            )
+            updated += 1
+        if len(page) < REMINDERS_PAGE_SIZE:
+            break
+        offset += REMINDERS_PAGE_SIZE
+
+    _ready_flags_backfilled = True
+    logger.info("reminders.backfill.completed", updated=updated)
+    return updated
+
+
+async def _search_ready_threads(client: LangGraphClient) -> list[Any]:
+    """Постранично забирает threads, в которых последним ответил ассистент.
+
+    Фильтр по metadata выполняется на стороне langgraph-api; остальные
+    условия проверяются в reminders_check. Флаг может смениться во время
+    обхода, и offset-страницы тогда сдвигаются — возможны повторы, поэтому
+    вызывающий код дедуплицирует threads по thread_id.
+    """
+    threads: list[Any] = []
+    offset = 0
+    while True:
+        page = await client.threads.search(
+            metadata={"ready_for_reminder": 1},
+            sort_by="created_at",
+            sort_order="desc",
+            limit=REMINDERS_PAGE_SIZE,
+            offset=offset,
+        )
+        threads.extend(page)
+        if len(page) < REMINDERS_PAGE_SIZE:
+            return threads
+        offset += REMINDERS_PAGE_SIZE
+
+
+async def _send_reminder(
+    client: LangGraphClient,
+    thread_id: str,
+    user_companychat: str,
+    reminded: int,
+    delivery: dict[str, Any],
+) -> bool:
+    """Генерирует и отправляет напоминание по одному thread.
+
+    Возвращает True, если напоминание доставлено.
+    """
+    # 6) достаём messages только теперь (дорогой вызов)
+    try:
+        thread_state = await client.threads.get_state(thread_id)
+    except Exception as e:
+        logger.warning("reminders.state_error", user_cc=user_companychat, thread_id=thread_id, error=str(e))
+        return False
+
+    messages = _extract_state_messages(thread_state)
+    if not messages:
+        return False
+
+    # 7) генерим напоминание
+    try:
+        agent_redialog_response = await client.runs.wait(
+            None,
+            assistant_id="agent_zena_redialog",
+            input={"messages": messages},
+            on_completion="delete",
+        )
+    except Exception as e:
+        logger.exception("reminders.redialog_failed", user_cc=user_companychat, thread_id=thread_id, error=str(e))
+        return False
+
+    reminder_text = _extract_reminder_text(agent_redialog_response)
+    if not reminder_text:
+        logger.warning("reminders.empty_text", user_cc=user_companychat, thread_id=thread_id)
+        return False
+
+    logger.info("reminders.response", user_cc=user_companychat, text_len=len(reminder_text))
+
+    # 8) отправка напоминания
+    try:
+        await sent_message_to_history(
+            user_id=int(delivery["delivery_user_id"]),
+            text=reminder_text,
+            user_companychat=int(user_companychat),
+            reply_to_history_id=int(delivery["delivery_reply_to_history_id"] or 0),
+            access_token=str(delivery["delivery_access_token"]),
+            tokens={},
+            tools=[],
+            tools_args={},
+            tools_result={},
+            prompt_system="",
+            template_prompt_system="",
+            dialog_state="",
+            dialog_state_new="",
+        )
+    except Exception as e:
+        logger.exception("reminders.send_failed", user_cc=user_companychat, thread_id=thread_id, error=str(e))
+        return False
+
+    # 9) фиксируем last_reminder_ts + reminded; update сливает metadata,
+    # поэтому user_companychat и delivery_* (взятые из неё же) не переписываем
+    try:
+        await _patch_thread_metadata(
+            client,
+            thread_id,
+            {
+                "last_reminder_ts": _utc_iso(),
+                "reminded": reminded + 1,
+            },
+        )
+    except Exception as e:
+        logger.warning(
+            "reminders.patch_failed",
+            user_cc=user_companychat,
+            thread_id=thread_id,
+            error=str(e),
+        )
+    return True
 
 
 @reminders_router.post("/check")
-async def reminders_check(body: dict[str, Any] | None = None) -> JSONResponse:
+async def reminders_check(
+    body: dict[str, Any] | None = None,
+    client: LangGraphClient = Depends(langgraph_client),
+) -> ORJSONResponse:
     """
     POST /agent/reminders/check
     body (опционально):
@@ -85,145 +244,97 @@ async def reminders_check(body: dict[str, Any] | None = None) -> JSONResponse:
     now = datetime.now(timezone.utc)
 
     scanned = 0
-    reminded_total = 0
     skipped_no_delivery = 0
+    eligible: list[tuple[str, str, int, dict[str, Any]]] = []
+    seen_thread_ids: set[str] = set()
 
-    async with langgraph_client() as client:
-        try:
-            threads = await client.threads.search(
-                sort_by="created_at",
-                sort_order="desc",
-            )
-
-
-        except TypeError:
-            return JSONResponse(
-                content={"success": False, "error": "Ошибка чтения threads"},
-                status_code=status.HTTP_400_BAD_REQUEST,
-            )
-
-        for th in threads:
-            scanned += 1
-            thread_id = th.get("thread_id")
-            md = th.get("metadata") or {}
-
-            user_companychat = md.get("user_companychat")
-            last_user_ts = _parse_iso(md.get("last_user_ts"))
-            last_assistant_ts = _parse_iso(md.get("last_assistant_ts"))
-            last_reminder_ts = _parse_iso(md.get("last_reminder_ts"))
-            last_dialog_state = md.get("last_dialog_state", "new")
-            reminded = _safe_int(md.get("reminded", 0), 0)
-
-            if not thread_id or not user_companychat:
-                continue
-
-            if last_dialog_state in ("new", None):
-                continue
-            
-            if reminded >= reminder_limit:
-                continue
-
-            # 1) должно быть что напоминать
-            if not last_assistant_ts:
-                continue
-
-            # 2) ассистент должен быть последним говорящим
-            if last_user_ts and last_user_ts > last_assistant_ts:
-                continue
-
-            # 3) таймаут
-            if now - last_assistant_ts < timedelta(minutes=timeout_minutes):
-                continue
-
-            # 4) cooldown
-            if last_reminder_ts and now - last_reminder_ts < timedelta(minutes=cooldown_minutes):
-                continue
-
-            # 5) реквизиты доставки
-            delivery = {
-                "delivery_user_id": md.get("delivery_user_id"),
-                "delivery_reply_to_history_id": md.get("delivery_reply_to_history_id", 0),
-                "delivery_access_token": md.get("delivery_access_token", ""),
-            }
-            if not delivery["delivery_user_id"] or not delivery["delivery_access_token"]:
-                skipped_no_delivery += 1
-                continue
-
-            # 6) достаём messages только теперь (дорогой вызов)
-            try:
-                thread_state = await client.threads.get_state(thread_id)
-            except Exception as e:
-                logger.warning("reminders.state_error", user_cc=user_companychat, thread_id=thread_id, error=str(e))
-                continue
-
-            messages = _extract_state_messages(thread_state)
-            if not messages:
-                continue
-
-            # 7) генерим напоминание
-            try:
-                agent_redialog_response = await client.runs.wait(
-                    None,
-                    assistant_id="agent_zena_redialog",
-                    input={"messages": messages},
-                    on_completion="delete",
-                )
-            except Exception as e:
-                logger.exception("reminders.redialog_failed", user_cc=user_companychat, thread_id=thread_id, error=str(e))
-                continue
-
-            reminder_text = _extract_reminder_text(agent_redialog_response)
-            if not reminder_text:
-                logger.warning("reminders.empty_text", user_cc=user_companychat, thread_id=thread_id)
-                continue
-
-            logger.info("reminders.response", user_cc=user_companychat, text_len=len(reminder_text))
+    try:
+        await _backfill_ready_flags(client)
+    except Exception as e:
+        # без backfill старые threads просто подождут следующей проверки
+        logger.warning("reminders.backfill.failed", error=str(e))
 
-            # 8) отправка напоминания
+    try:
+        threads = await _search_ready_threads(client)
+    except TypeError:
+        return ORJSONResponse(
+            content={"success": False, "error": "Ошибка чтения threads"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+    for th in threads:
+        scanned += 1
+        thread_id = th.get("thread_id")
+        md = th.get("metadata") or {}
+
+        user_companychat = md.get("user_companychat")
+        last_user_ts = _parse_iso(md.get("last_user_ts"))
+        last_assistant_ts = _parse_iso(md.get("last_assistant_ts"))
+        last_reminder_ts = _parse_iso(md.get("last_reminder_ts"))
+        last_dialog_state = md.get("last_dialog_state", "new")
+        reminded = _safe_int(md.get("reminded", 0), 0)
+
+        if not thread_id or not user_companychat:
+            continue
+
+        # страницы по offset могут пересекаться — одно напоминание на thread
+        if thread_id in seen_thread_ids:
+            continue
+        seen_thread_ids.add(thread_id)
+
+        if last_dialog_state in ("new", None):
+            continue
+        
+        if reminded >= reminder_limit:
+            continue
+
+        # 1) должно быть что напоминать
+        if not last_assistant_ts:
+            continue
+
+        # 2) ассистент должен быть последним говорящим
+        if last_user_ts and last_user_ts > last_assistant_ts:
+            continue
+
+        # 3) таймаут
+        if now - last_assistant_ts < timedelta(minutes=timeout_minutes):
+            continue
+
+        # 4) cooldown
+        if last_reminder_ts and now - last_reminder_ts < timedelta(minutes=cooldown_minutes):
+            continue
+
+        # 5) реквизиты доставки
+        delivery = {
+            "delivery_user_id": md.get("delivery_user_id"),
+            "delivery_reply_to_history_id": md.get("delivery_reply_to_history_id", 0),
+            "delivery_access_token": md.get("delivery_access_token", ""),
+        }
+        if not delivery["delivery_user_id"] or not delivery["delivery_access_token"]:
+            skipped_no_delivery += 1
+            continue
+
+        eligible.append((thread_id, str(user_companychat), reminded, delivery))
+
+    # 6-9) дорогие вызовы — параллельно, но не более REMINDERS_MAX_PARALLEL за раз
+    semaphore = asyncio.Semaphore(REMINDERS_MAX_PARALLEL)
+
+    async def _bounded(
+        thread_id: str, user_companychat: str, reminded: int, delivery: dict[str, Any]
+    ) -> bool:
+        async with semaphore:
+            # ошибка одного thread не должна отменять остальные задачи группы
             try:
-                await sent_message_to_history(
-                    user_id=int(delivery["delivery_user_id"]),
-                    text=reminder_text,
-                    user_companychat=int(user_companychat),
-                    reply_to_history_id=int(delivery["delivery_reply_to_history_id"] or 0),
-                    access_token=str(delivery["delivery_access_token"]),
-                    tokens={},
-                    tools=[],
-                    tools_args={},
-                    tools_result={},
-                    prompt_system="",
-                    template_prompt_system="",
-                    dialog_state="",
-                    dialog_state_new="",
-                )
+                return await _send_reminder(client, thread_id, user_companychat, reminded, delivery)
             except Exception as e:
-                logger.exception("reminders.send_failed", user_cc=user_companychat, thread_id=thread_id, error=str(e))
-                continue
+                logger.exception("reminders.unexpected_error", user_cc=user_companychat, thread_id=thread_id, error=str(e))
+                return False
 
-            reminded += 1
-            reminded_total += 1
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(_bounded(*item)) for item in eligible]
+    reminded_total = sum(1 for task in tasks if task.result())
 
-            # 9) фиксируем last_reminder_ts + reminded (и сохраняем delivery)
-            try:
-                await _patch_thread_metadata(
-                    client,
-                    thread_id,
-                    {
-                        "user_companychat": str(user_companychat),
-                        "last_reminder_ts": _utc_iso(),
-                        "reminded": reminded,
-                        **delivery,
-                    },
-                )
-            except Exception as e:
-                logger.warning(
-                    "reminders.patch_failed",
-                    user_cc=user_companychat,
-                    thread_id=thread_id,
-                    error=str(e),
-                )
-
-    return JSONResponse(
+    return ORJSONResponse(
         content={
             "success": True,
             "timeout_minutes": timeout_minutes,
@@ -1,39 +1,66 @@
 """Модуль реализует endpoint update/faq."""
 
+import asyncio
+
 import asyncpg
 from fastapi import APIRouter, Depends, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
 from ..deps import get_pg_pool
 from ..update.postgres_common import is_channel_id  # type: ignore
-from ..update.postgres_update_faq_from_sheet import (
-    update_faq_from_sheet,  # type: ignore
-)
-from ..update.qdrant_creat_faq import qdrant_create_faq_async  # type: ignore
 from ..zena_logging import get_logger, timed_block
+from ._helpers import fail
 
 router = APIRouter(prefix="/update", tags=["update"])
 
 logger = get_logger()
 
+# Ответ на update=False не зависит от запроса — тело сериализуется один раз
+_UPDATE_FALSE_RESPONSE = fail(
+    "Параметр: update = False. Для обновления установите: True.",
+    status.HTTP_400_BAD_REQUEST,
+)
+
+# Обновления FAQ в работе по channel_id: одновременные запросы ждут одну задачу
+_faq_inflight: dict[int, asyncio.Task[ORJSONResponse]] = {}
+
 
 @router.post("/faq")
-async def update_faq(channel_id: int, update: bool = False, pool: asyncpg.Pool = Depends(get_pg_pool)) -> JSONResponse:  # type: ignore[type-arg]
+async def update_faq(channel_id: int, update: bool = False, pool: asyncpg.Pool = Depends(get_pg_pool)) -> ORJSONResponse:  # type: ignore[type-arg]
     """Определение endpoint."""
     try:
         if not update:
             logger.info("update.faq.skipped", channel_id=channel_id, reason="update=False")
-            return JSONResponse(
-                content={"success": False, "exception": "Параметр: update = False. Для обновления установите: True."},
-                status_code=status.HTTP_400_BAD_REQUEST,
-            )
+            return _UPDATE_FALSE_RESPONSE
 
         if not await is_channel_id(channel_id, pool):
             logger.info("update.faq.not_found", channel_id=channel_id)
-            return JSONResponse(
-                content={"success": False, "exception": f"Нет фирмы с channel_id = {channel_id}"},
-                status_code=status.HTTP_404_NOT_FOUND,
-            )
+            return fail(f"Нет фирмы с channel_id = {channel_id}", status.HTTP_404_NOT_FOUND)
+
+        task = _faq_inflight.get(channel_id)
+        if task is None:
+            task = asyncio.create_task(_run_update_faq(channel_id, pool))
+            _faq_inflight[channel_id] = task
+            task.add_done_callback(lambda _: _faq_inflight.pop(channel_id, None))
+        else:
+            logger.info("update.faq.coalesced", channel_id=channel_id)
+        # shield: отмена одного запроса не прерывает обновление для остальных
+        return await asyncio.shield(task)
+
+    except Exception as e:
+        logger.exception("update.faq.error", channel_id=channel_id, error=str(e))
+        return fail(f"Ошибка обновления: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+async def _run_update_faq(channel_id: int, pool: asyncpg.Pool) -> ORJSONResponse:  # type: ignore[type-arg]
+    """Обновление postgres из GoogleSheet и пересоздание коллекции qdrant."""
+    try:
+        # Тяжёлые модули (qdrant_client, fastembed, openai, gspread) грузим при первом
+        # обновлении, а не при старте воркера — /update/* вызывается редко
+        from ..update.postgres_update_faq_from_sheet import (
+            update_faq_from_sheet,  # type: ignore
+        )
+        from ..update.qdrant_creat_faq import qdrant_create_faq_async  # type: ignore
 
         logger.info("update.faq.started", channel_id=channel_id)
 
@@ -41,29 +68,26 @@ async def update_faq(channel_id: int, update: bool = False, pool: asyncpg.Pool =
             postgres_ok = await update_faq_from_sheet(channel_id, pool)
         if not postgres_ok:
             logger.error("update.faq.failed", channel_id=channel_id, stage="postgres")
-            return JSONResponse(
-                content={"success": False, "exception": f"Ошибка обновления postgres из GoogleSheet для channel_id = {channel_id}"},
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            return fail(
+                f"Ошибка обновления postgres из GoogleSheet для channel_id = {channel_id}",
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
         async with timed_block("update.faq.qdrant"):
             qdrant_ok = await qdrant_create_faq_async(pool)
         if not qdrant_ok:
             logger.error("update.faq.failed", channel_id=channel_id, stage="qdrant")
-            return JSONResponse(
-                content={"success": False, "exception": "Ошибка обновления qdrant из postgres."},
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            return fail(
+                "Ошибка обновления qdrant из postgres.",
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
         logger.info("update.faq.completed", channel_id=channel_id)
-        return JSONResponse(
+        return ORJSONResponse(
             content={"success": True, "comment": f"Данные успешно обновлены из GoogleSheet для channel_id = {channel_id}."},
             status_code=status.HTTP_200_OK,
         )
 
     except Exception as e:
         logger.exception("update.faq.error", channel_id=channel_id, error=str(e))
-        return JSONResponse(
-            content={"success": False, "exception": f"Ошибка обновления: {e}"},
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        )
+        return fail(f"Ошибка обновления: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -2,37 +2,39 @@
 
 import asyncpg
 from fastapi import APIRouter, Depends, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
 from ..deps import get_pg_pool
 from ..update.postgres_common import is_channel_id  # type: ignore
-from ..update.postgres_update_promo_from_sheet import (
-    update_promo_from_sheet,  # type: ignore
-)
 from ..zena_logging import get_logger, timed_block
+from ._helpers import fail
 
 router = APIRouter(prefix="/update", tags=["update"])
 
 logger = get_logger()
 
+_UPDATE_FALSE_RESPONSE = fail(
+    "Параметр: update = False. Для обновления установите: True.",
+    status.HTTP_400_BAD_REQUEST,
+)
+
 
 @router.post("/promo")
-async def update_promo(channel_id: int, update: bool = False, pool: asyncpg.Pool = Depends(get_pg_pool)) -> JSONResponse:  # type: ignore[type-arg]
+async def update_promo(channel_id: int, update: bool = False, pool: asyncpg.Pool = Depends(get_pg_pool)) -> ORJSONResponse:  # type: ignore[type-arg]
     """Определение endpoint."""
     try:
         if not update:
             logger.info("update.promo.skipped", channel_id=channel_id, reason="update=False")
-            return JSONResponse(
-                content={"success": False, "exception": "Параметр: update = False. Для обновления установите: True."},
-                status_code=status.HTTP_400_BAD_REQUEST,
-            )
+            return _UPDATE_FALSE_RESPONSE
 
         if not await is_channel_id(channel_id, pool):
             logger.info("update.promo.not_found", channel_id=channel_id)
-            return JSONResponse(
-                content={"success": False, "exception": f"Нет фирмы с channel_id = {channel_id}"},
-                status_code=status.HTTP_404_NOT_FOUND,
-            )
+            return fail(f"Нет фирмы с channel_id = {channel_id}", status.HTTP_404_NOT_FOUND)
+
+        # ленивый импорт: gspread/qdrant нужны только при обновлении
+        from ..update.postgres_update_promo_from_sheet import (
+            update_promo_from_sheet,  # type: ignore
+        )
 
         logger.info("update.promo.started", channel_id=channel_id)
 
@@ -40,20 +42,17 @@ async def update_promo(channel_id: int, update: bool = False, pool: asyncpg.Pool
             postgres_ok = await update_promo_from_sheet(channel_id, pool)
         if not postgres_ok:
             logger.error("update.promo.failed", channel_id=channel_id, stage="postgres")
-            return JSONResponse(
-                content={"success": False, "exception": f"Ошибка обновления postgres из GoogleSheet для channel_id = {channel_id}"},
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            return fail(
+                f"Ошибка обновления postgres из GoogleSheet для channel_id = {channel_id}",
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
         logger.info("update.promo.completed", channel_id=channel_id)
-        return JSONResponse(
+        return ORJSONResponse(
             content={"success": True, "comment": f"Данные успешно обновлены из GoogleSheet для channel_id = {channel_id}."},
             status_code=status.HTTP_200_OK,
         )
 
     except Exception as e:
         logger.exception("update.promo.error", channel_id=channel_id, error=str(e))
-        return JSONResponse(
-            content={"success": False, "exception": f"Ошибка обновления: {e}"},
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        )
+        return fail(f"Ошибка обновления: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -43,12 +43,17 @@ class AgentRunParams(BaseModel):
         "agent_zena_egoistka": [5017, 15017],
     }
 
+    # Обратный индекс port -> agent строится один раз при определении класса
+    _port_to_agent: ClassVar[dict[int, str]] = {
+        port: agent_name for agent_name, ports in agent.items() for port in ports
+    }
+
     @classmethod
     def get_agent_by_mcp_port(cls, mcp_port: int) -> str:
-        for agent_name, ports in cls.agent.items():
-            if mcp_port in ports:
-                return agent_name
-        raise ValueError(f"Agent not found for mcp_port={mcp_port}")
+        try:
+            return cls._port_to_agent[mcp_port]
+        except KeyError:
+            raise ValueError(f"Agent not found for mcp_port={mcp_port}") from None
 
     @model_validator(mode="before")
     @classmethod
@@ -57,11 +62,7 @@ class AgentRunParams(BaseModel):
         if not isinstance(values, dict):
             return values
 
-        logger.debug("agent.params.received", values=values)
-
         mcp_port = values.get("mcp_port") or 5007
-        logger.debug("agent.params.mcp_port", mcp_port=mcp_port)
-
         assistant_id = cls.get_agent_by_mcp_port(mcp_port)
 
         values.update(
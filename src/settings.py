@@ -1,6 +1,9 @@
 """Модуль определения переменных проекта."""
 
 import os
+from collections.abc import Mapping
+from functools import cached_property, lru_cache
+from types import MappingProxyType
 from typing import Any
 
 from pydantic import Field
@@ -27,23 +30,37 @@ class Settings(BaseSettings):
     langgraph_url_docker: str = "http://langgraph-api:8000"
     langgraph_url_no_docker: str = "http://localhost:2024"
 
-    @property
+    @cached_property
     def langgraph_url(self) -> str:
-        """Определение свойства."""
+        """Определение свойства (IS_DOCKER читается один раз на экземпляр)."""
         return (
             self.langgraph_url_docker if is_docker() else self.langgraph_url_no_docker
         )
 
     qdrant_url: str = Field(env='QDRANT_URL')
     qdrant_timeout: int = Field(env='QDRANT_TIMEOUT')
+    # gRPC вместо REST/JSON: бинарные векторы при загрузке и поиске.
+    # Включать, только если порт gRPC Qdrant доступен из контейнера
+    qdrant_prefer_grpc: bool = False
+    qdrant_grpc_port: int = 6334
+    # Процессы для BM25 при пересборке коллекций (0 — считать в потоке)
+    bm25_workers: int = 2
     qdrant_collection_faq: str = Field(env='QDRANT_COLLECTION_FAQ')
     qdrant_collection_services: str = Field(env='QDRANT_COLLECTION_SERVICES')
     qdrant_collection_products: str = Field(env='QDRANT_COLLECTION_PRODUCTS')
     qdrant_collection_temp: str = Field(env='QDRANT_COLLECTION_TEMP')
+    # Сколько батчей одновременно эмбеддится и загружается при пересборке коллекций
+    qdrant_upload_parallel: int = 2
+    # Точек в одном upsert к Qdrant (при таймауте загрузка сама уменьшает кусок)
+    qdrant_upload_batch_size: int = 256
 
     openai_api_key: str = Field(env='OPENAI_API_KEY')
     openai_proxy_url: str = Field(env='OPENAI_PROXY_URL')
     openai_timeout: int = Field(env='OPENAI_TIMEOUT')
+    # Дисковый кэш эмбеддингов для пересборки коллекций (пусто — выключен)
+    embedding_cache_path: str = "/tmp/apifast/embeddings.sqlite"
+    # Максимум записей в кэше (~6 КБ на вектор ada-002), старые вытесняются
+    embedding_cache_max_entries: int = 50_000
 
     postgres_user: str = Field(env='POSTGRES_USER')
     postgres_password: str = Field(env='POSTGRES_PASSWORD')
@@ -54,16 +71,24 @@ class Settings(BaseSettings):
     postgres_pool_min_size: int = 2
     postgres_pool_max_size: int = 10
     postgres_command_timeout: int = 60
+    # Кэш подготовленных выражений asyncpg на соединение пула
+    postgres_statement_cache_size: int = 1024
 
-    @property
-    def postgres_config(self) -> dict[str, Any]:
-        """Определение свойства."""
-        return {
+    @cached_property
+    def postgres_config(self) -> Mapping[str, Any]:
+        """Параметры подключения к Postgres (вычисляются один раз, только для чтения)."""
+        return MappingProxyType({
             "user": self.postgres_user,
             "password": self.postgres_password,
             "database": self.postgres_db,
             "host": self.postgres_host,
             "port": self.postgres_port,
-        }
+        })
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Единственный экземпляр Settings на процесс (.env читается один раз)."""
+    return Settings()
+
+
+settings = get_settings()
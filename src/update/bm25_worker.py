@@ -0,0 +1,27 @@
+"""BM25-эмбеддинги в дочерних процессах.
+
+Модуль намеренно не тянет настройки и клиенты из qdrant_common: он
+импортируется в каждом процессе пула (spawn), нужен ему только fastembed.
+"""
+
+from typing import Any
+
+from fastembed.sparse.bm25 import Bm25
+
+_model: Bm25 | None = None
+
+
+def init_bm25(model_path: str | None) -> None:
+    """Инициализатор процесса пула: загружает модель BM25 один раз."""
+    global _model
+    _model = Bm25(
+        "Qdrant/bm25",
+        language="russian",
+        **({"specific_model_path": model_path} if model_path else {}),
+    )
+
+
+def embed_passages(texts: list[str]) -> list[dict[str, Any]]:
+    """Считает sparse-векторы BM25 и возвращает их как простые словари."""
+    assert _model is not None, "init_bm25 не был вызван"
+    return [emb.as_object() for emb in _model.passage_embed(texts)]
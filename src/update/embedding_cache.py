@@ -0,0 +1,70 @@
+"""Дисковый кэш эмбеддингов (sqlite), ключ — хэш модели и текста.
+
+Пересборки коллекций раз за разом эмбеддят одни и те же тексты; кэш
+превращает повторный запрос к OpenAI в локальный поиск по ключу.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from array import array
+from pathlib import Path
+
+
+class EmbeddingCache:
+    """Потокобезопасное хранилище векторов в sqlite.
+
+    Методы синхронные — из асинхронного кода их вызывают через asyncio.to_thread.
+    Размер ограничен max_entries записями: при переполнении удаляются самые
+    давно добавленные (вектор ada-002 — около 6 КБ на запись).
+    """
+
+    def __init__(self, path: str, max_entries: int = 50_000) -> None:
+        """Открывает (или создаёт) файл кэша по пути path."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        """Ключ записи: хэш модели и текста."""
+        return hashlib.blake2b(f"{model}\0{text}".encode(), digest_size=16).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """Возвращает найденные векторы по ключам."""
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            # sqlite ограничивает число параметров запроса — читаем кусками
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[h] = vec.tolist()
+        return found
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        """Сохраняет векторы (float32) и вытесняет старые записи сверх max_entries."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (hash, vec) VALUES (?, ?)",
+                [(h, array("f", vec).tobytes()) for h, vec in items.items()],
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                # rowid растёт с каждой вставкой — меньшие rowid добавлены раньше
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)",
+                    (count - self.max_entries,),
+                )
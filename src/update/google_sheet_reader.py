@@ -4,13 +4,15 @@
 
 from __future__ import annotations
 
-import asyncio
+import functools
 import json
 import os
 import tempfile
 from pathlib import Path
 from typing import Any, Type
 
+import anyio
+import anyio.to_thread
 import gspread
 
 from ..common import retry_async  # type: ignore
@@ -18,13 +20,15 @@ from ..zena_logging import get_logger  # type: ignore
 
 logger = get_logger()
 
-# 🔐 кеш временного файла, чтобы не плодить файлы при retry
-_TMP_SA_FILE: str | None = None
+# Отдельный лимит потоков для gspread: параллельные обновления не должны
+# занимать весь общий пул to_thread
+_SHEET_LIMITER = anyio.CapacityLimiter(4)
 
 
 BASE_DIR = Path(__file__).resolve().parents[3]   # /app
 SERVICE_ACCOUNT_FILE = str(BASE_DIR / "deploy" / "aiucopilot-d6773dc31cb0.json")
 
+@functools.lru_cache(maxsize=1)
 def get_service_account_file() -> str:
     """
     Возвращает путь к json сервисного аккаунта.
@@ -32,19 +36,17 @@ def get_service_account_file() -> str:
     Приоритет:
     1) SERVICE_ACCOUNT_FILE — если передан путь и файл существует
     2) GOOGLE_SA_JSON — строкой (из env / env_file) → пишем во временный файл
-    """
-    global _TMP_SA_FILE
 
+    Результат кешируется на процесс: env читается и временный файл пишется один раз
+    (в том числе при retry). Ошибка не кешируется — следующий вызов повторит попытку.
+    Вызывается из event loop без await, поэтому гонки между корутинами нет.
+    """
     # 1️⃣ Явно переданный путь
     path = os.getenv("SERVICE_ACCOUNT_FILE")
     if path and Path(path).exists():
         return path
 
-    # 2️⃣ Уже созданный временный файл (при retry)
-    if _TMP_SA_FILE and Path(_TMP_SA_FILE).exists():
-        return _TMP_SA_FILE
-
-    # 3️⃣ JSON из env
+    # 2️⃣ JSON из env
     sa_json = os.getenv("GOOGLE_SA_JSON")
     if not sa_json:
         raise RuntimeError(
@@ -65,8 +67,17 @@ def get_service_account_file() -> str:
     tmp.flush()
     tmp.close()
 
-    _TMP_SA_FILE = tmp.name
-    return _TMP_SA_FILE
+    return tmp.name
+
+
+@functools.lru_cache(maxsize=4)
+def _get_gspread_client(service_account_file: str) -> gspread.Client:
+    """Общий на процесс gspread-клиент для файла сервисного аккаунта.
+
+    Клиент держит авторизованную HTTP-сессию (keep-alive, обновление токена),
+    поэтому ридеры переиспользуют его вместо нового TLS-соединения на каждый create().
+    """
+    return gspread.service_account(service_account_file)
 
 
 class UniversalGoogleSheetReader:
@@ -103,17 +114,17 @@ class UniversalGoogleSheetReader:
         - аутентификация сервисным аккаунтом
         - открытие таблицы
         - получение листа
-        - чтение заголовков
+
+        Заголовки отдельным запросом не читаются — они приходят первой строкой
+        в get_all_values.
         """
         try:
             # 🔑 гарантируем существование json-файла
             if not self.service_account_file:
                 self.service_account_file = get_service_account_file()
 
-            self.gc = gspread.service_account(self.service_account_file)
-            self.sh = self.gc.open_by_url(self.spreadsheet_url)
-            self.ws = self.sh.worksheet(self.sheet_name)
-            self.headers = self.ws.row_values(1)
+            # gspread синхронный (requests): сетевые вызовы уводим из event loop
+            await anyio.to_thread.run_sync(self._open_worksheet, limiter=_SHEET_LIMITER)
 
         except gspread.exceptions.APIError as api_err:
             logger.error(
@@ -137,10 +148,19 @@ class UniversalGoogleSheetReader:
             )
             raise
 
+    def _open_worksheet(self) -> None:
+        """Синхронное открытие листа; выполняется в отдельном потоке."""
+        self.gc = _get_gspread_client(self.service_account_file)
+        self.sh = self.gc.open_by_url(self.spreadsheet_url)
+        self.ws = self.sh.worksheet(self.sheet_name)
+
     async def _get_all_rows_async(self) -> list[dict[str, Any]]:
         """Асинхронное чтение всех строк."""
         try:
-            rows = await asyncio.to_thread(self.ws.get_all_values)
+            rows = await anyio.to_thread.run_sync(self.ws.get_all_values, limiter=_SHEET_LIMITER)
+            if not rows:
+                return []
+            self.headers = rows[0]
             return [dict(zip(self.headers, row)) for row in rows[1:]]
         except gspread.exceptions.APIError as api_err:
             logger.error("google_sheets.error", stage="reading", error=str(api_err))
@@ -1,19 +1,58 @@
 """Модуль вспомогательных функций postgres."""
 
+from collections.abc import AsyncGenerator
+from typing import Any
+
 import asyncpg
 
+from ..common import TTLCache  # type: ignore
+
+# Кэшируются только найденные channel_id: новый канал виден сразу после добавления
+_channel_id_cache: TTLCache[int, bool] = TTLCache(maxsize=1024, ttl=300)
+
 
 async def is_channel_id(channel_id: int, pool: asyncpg.Pool) -> bool:  # type: ignore[type-arg]
     """Проверка на наличие channel_id."""
+    if _channel_id_cache.get(channel_id):
+        return True
     async with pool.acquire() as conn:
-        row: asyncpg.Record | None = await conn.fetchrow(
+        # EXISTS + fetchval: сервер останавливается на первой строке, Record не создаётся
+        exists: bool = await conn.fetchval(
             """
-            SELECT cc.id
-            FROM channel_chattype cc
-            WHERE cc.channel_id = $1
+            SELECT EXISTS (
+                SELECT 1
+                FROM channel_chattype cc
+                WHERE cc.channel_id = $1
+            )
         """,
             channel_id,
         )
-        return bool(row)
+    if exists:
+        _channel_id_cache.set(channel_id, True)
+    return exists
+
+
+async def fetch_batches(
+    pool: asyncpg.Pool,  # type: ignore[type-arg]
+    query: str,
+    *args: Any,
+    batch_size: int,
+) -> AsyncGenerator[list[asyncpg.Record], None]:
+    """Читает результат запроса серверным курсором батчами по batch_size записей.
 
+    Курсор живёт в транзакции на отдельном соединении пула, весь результат
+    в память не загружается. Итератор нужно закрывать (contextlib.aclosing),
+    если он прочитан не до конца.
 
+    Строки отдаются как asyncpg.Record без копирования в dict: словарь
+    строит потребитель и только для тех записей, которые ему нужны.
+    """
+    async with pool.acquire() as conn, conn.transaction():
+        batch: list[asyncpg.Record] = []
+        async for r in conn.cursor(query, *args, prefetch=batch_size):
+            batch.append(r)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
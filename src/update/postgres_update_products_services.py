@@ -1,32 +1,41 @@
-import asyncio
-from typing import Any
-
 import asyncpg
+from qdrant_client import models
 
 from ..settings import settings  # type: ignore
 from ..zena_logging import get_logger  # type: ignore
+from .qdrant_common import (
+    ADA_SEARCH_PARAMS,
+    batch_iterable,
+    cached_ada_embeddings,
+    qdrant_client,
+    retry_request,
+)
 from .qdrant_create_services import qdrant_create_services_async
-from .qdrant_retriever_faq_services import retriver_hybrid_async
 
 logger = get_logger()
 
 QDRANT_COLLECTION_TEMP = settings.qdrant_collection_temp
 
+# Сколько названий продуктов уходит в один запрос эмбеддингов / один query_batch_points
+MATCH_BATCH_SIZE = 256
+
+# Расширение создаётся один раз за жизнь процесса, дальше CREATE EXTENSION не шлём
+_amcheck_enabled = False
+
 
 async def _try_enable_amcheck(conn: asyncpg.Connection) -> bool:
+    global _amcheck_enabled
+    if _amcheck_enabled:
+        return True
     try:
         await conn.execute("CREATE EXTENSION IF NOT EXISTS amcheck;")
+        _amcheck_enabled = True
         return True
     except Exception as e:
         logger.warning("postgres.amcheck_unavailable", error=str(e))
         return False
 
 
-async def _index_exists(conn: asyncpg.Connection, index_regclass: str) -> bool:
-    row = await conn.fetchrow("SELECT to_regclass($1) IS NOT NULL AS ok;", index_regclass)
-    return bool(row and row["ok"])
-
-
 async def _btree_index_check(conn: asyncpg.Connection, index_regclass: str) -> tuple[bool, str | None]:
     try:
         # thorough = true
@@ -52,14 +61,8 @@ async def _check_and_fix_products_indexes(conn: asyncpg.Connection) -> None:
     if not await _try_enable_amcheck(conn):
         return
 
-    # 1) Приоритетно проверим уникальный индекс по article (частый виновник)
-    primary_suspect = "public.products_article_key"
-    suspects: list[str] = []
-
-    if await _index_exists(conn, primary_suspect):
-        suspects.append(primary_suspect)
-
-    # 2) Добавим остальные btree-индексы products (на случай более широкой порчи)
+    # Все btree-индексы products одним запросом; уникальный индекс по article
+    # (частый виновник) — первым в списке
     rows = await conn.fetch(
         """
         SELECT (quote_ident(n.nspname) || '.' || quote_ident(ic.relname)) AS idx
@@ -70,13 +73,11 @@ async def _check_and_fix_products_indexes(conn: asyncpg.Connection) -> None:
         JOIN pg_am am ON am.oid = ic.relam
         WHERE n.nspname = 'public'
           AND c.relname = 'products'
-          AND am.amname = 'btree';
+          AND am.amname = 'btree'
+        ORDER BY ic.relname <> 'products_article_key';
         """
     )
-    for r in rows:
-        idx = r["idx"]
-        if idx not in suspects:
-            suspects.append(idx)
+    suspects = [r["idx"] for r in rows]
 
     if not suspects:
         logger.info("btree-индексы для public.products не найдены — проверка пропущена")
@@ -96,16 +97,20 @@ async def _check_and_fix_products_indexes(conn: asyncpg.Connection) -> None:
         return
 
     # Сначала чиним точечно каждый битый индекс
+    reindex_failed: list[str] = []
     for idx, _ in bad:
         try:
             logger.warning("postgres.reindex", index=idx)
             await _reindex_index(conn, idx)
         except Exception as e:
+            reindex_failed.append(idx)
             logger.error("postgres.reindex.failed", index=idx, error=str(e))
 
-    # Перепроверка: если что-то осталось — REINDEX TABLE целиком
+    # Успешный REINDEX строит индекс заново из таблицы — повторный полный
+    # bt_index_check нужен только там, где REINDEX упал.
+    # Если что-то осталось битым — REINDEX TABLE целиком
     still_bad: list[str] = []
-    for idx, _ in bad:
+    for idx in reindex_failed:
         ok, err = await _btree_index_check(conn, idx)
         if not ok:
             still_bad.append(idx)
@@ -131,7 +136,6 @@ async def update_products_services(
     pool: asyncpg.Pool,  # type: ignore[type-arg]
     collection_name: str = QDRANT_COLLECTION_TEMP,
     qdrant_create_services: bool = True,
-    max_parallel: int = 10,
 ) -> bool:
     logger.info("update_products_services")
     logger.info(
@@ -149,47 +153,41 @@ async def update_products_services(
                 channel_id=channel_id,
             )
 
-    semaphore = asyncio.Semaphore(max_parallel)
     try:
         async with pool.acquire() as conn:
             # ВАЖНО: до транзакции
             await _check_and_fix_products_indexes(conn)
 
-            async with conn.transaction():
-                logger.info("Получение id сервисов для удаления связанных записей.")
-                service_ids = await conn.fetch(
-                    "SELECT id FROM services WHERE channel_id = $1", channel_id
-                )
-                ids_to_delete = [record["id"] for record in service_ids]
+            # Сопоставление продуктов с сервисами (сеть к OpenAI/Qdrant) — тоже до
+            # транзакции: products она не меняет, а блокировки держатся меньше
+            logger.info("Получение продуктов канала.")
+            products = await conn.fetch(
+                "SELECT product_full_name as product_name, article FROM products WHERE channel_id = $1",
+                channel_id,
+            )
 
-                logger.info("Удаление связанных записей из products_services.")
-                if ids_to_delete:
-                    await conn.execute(
-                        "DELETE FROM products_services WHERE service_id = ANY($1::int[])",
-                        ids_to_delete,
-                    )
+            logger.info("Пакетный поиск service_id для продуктов")
+            insert_tuples = await _match_service_ids(products, channel_id, collection_name)
 
-                logger.info("Получение продуктов канала.")
-                products = await conn.fetch(
-                    "SELECT product_full_name as product_name, article FROM products WHERE channel_id = $1",
+            async with conn.transaction():
+                logger.info("Удаление связанных записей из products_services.")
+                # Соединение с services на стороне Postgres — без выгрузки id в клиент
+                await conn.execute(
+                    """
+                    DELETE FROM products_services ps
+                    USING services s
+                    WHERE ps.service_id = s.id AND s.channel_id = $1
+                    """,
                     channel_id,
                 )
 
-                logger.info("Параллельный сбор service_id для продуктов с ограничением")
-                tasks = [
-                    _fetch_service_id(product, channel_id, semaphore)
-                    for product in products
-                ]
-                results = await asyncio.gather(*tasks)
-
-                logger.info("Фильтрация успешных результатов")
-                insert_tuples = [res for res in results if res is not None]
-
                 logger.info("Вставка новых записей в products_services")
                 if insert_tuples:
-                    await conn.executemany(
-                        "INSERT INTO products_services (article_id, service_id) VALUES ($1, $2)",
-                        insert_tuples,
+                    # COPY FROM STDIN: один поток данных вместо отдельного INSERT на строку
+                    await conn.copy_records_to_table(
+                        "products_services",
+                        records=insert_tuples,
+                        columns=("article_id", "service_id"),
                     )
 
             logger.info(
@@ -207,26 +205,68 @@ async def update_products_services(
         return False
 
 
-async def _fetch_service_id(
-    product: dict[str, Any],
+async def _match_service_ids(
+    products: list[asyncpg.Record],
     channel_id: int,
-    semaphore: asyncio.Semaphore,
-) -> tuple[str, int] | None:
-    async with semaphore:
+    collection_name: str,
+) -> list[tuple[str, int]]:
+    """Находит ближайший сервис для каждого продукта пакетными запросами.
+
+    Вместо отдельного эмбеддинга и query_points на продукт: один запрос эмбеддингов
+    и один query_batch_points на MATCH_BATCH_SIZE уникальных названий — одинаковые
+    названия у разных артикулов ищутся один раз. Продукты без названия
+    пропускаются. Ошибка любого батча логируется и пробрасывается: перезапись
+    связки отменяется, старые связи сохраняются.
+    """
+    # dict сохраняет порядок первого появления названия
+    unique_names = list(
+        dict.fromkeys(
+            p["product_name"] for p in products if (p["product_name"] or "").strip()
+        )
+    )
+    channel_filter = models.Filter(
+        must=[
+            models.FieldCondition(
+                key="channel_id", match=models.MatchValue(value=channel_id)
+            )
+        ]
+    )
+
+    name_to_service: dict[str, int] = {}
+    for batch in batch_iterable(unique_names, MATCH_BATCH_SIZE):
         try:
-            result = await retriver_hybrid_async(
-                query=product["product_name"],
-                database_name=QDRANT_COLLECTION_TEMP,
-                channel_id=channel_id,
-                hybrid=False,
-                limit=1,
+            vectors = await cached_ada_embeddings(list(batch))
+            responses = await retry_request(
+                qdrant_client.query_batch_points,
+                collection_name=collection_name,
+                requests=[
+                    models.QueryRequest(
+                        query=vector,
+                        using="ada-embedding",
+                        params=ADA_SEARCH_PARAMS,
+                        filter=channel_filter,
+                        limit=1,
+                        with_payload=False,
+                    )
+                    for vector in vectors
+                ],
             )
-            if result:
-                return (product["article"], result[0]["id"])
         except Exception as e:
             logger.error(
                 "postgres.fetch.service_id_failed",
-                article=product["article"],
+                product_names=list(batch),
                 error=str(e),
             )
-        return None
+            raise
+
+        name_to_service.update(
+            (name, response.points[0].id)
+            for name, response in zip(batch, responses)
+            if response.points
+        )
+
+    return [
+        (p["article"], name_to_service[p["product_name"]])
+        for p in products
+        if p["product_name"] in name_to_service
+    ]
@@ -1,21 +1,35 @@
 """Модуль общих функций для работы с qdrant."""
 
 import asyncio
+import functools
 import inspect
+import multiprocessing
 import os
 import random
-from collections.abc import Iterator
+import sqlite3
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from itertools import islice
 from typing import Any, Awaitable, Callable, Sequence, TypeVar, Union
 
 import httpx
+import openai
 from fastembed.sparse.bm25 import Bm25
+from grpc import StatusCode
+from grpc.aio import AioRpcError
 from openai import AsyncOpenAI
 from openai.types.create_embedding_response import CreateEmbeddingResponse
 from qdrant_client import AsyncQdrantClient, models
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from tqdm.asyncio import tqdm_asyncio
 
 # Свои модули
+from ..common import TTLCache, gather_or_cancel  # type: ignore
 from ..settings import settings  # type: ignore
 from ..zena_logging import get_logger  # type: ignore
+from .bm25_worker import embed_passages, init_bm25
+from .embedding_cache import EmbeddingCache
 
 logger = get_logger()
 
@@ -23,6 +37,23 @@ T = TypeVar("T")
 
 RETRY_COUNT = 3
 RETRY_BACKOFF = 2.0
+RETRY_MAX_WAIT = 30.0
+
+# Параметр HNSW m для коллекций (количество соседей в графе)
+HNSW_M = 32
+
+# Размер батча при пересборке коллекций: столько текстов уходит в один запрос
+# эмбеддингов OpenAI (лимит API — 2048 входов и ~300k токенов на запрос).
+# В Qdrant тот же батч грузится кусками по settings.qdrant_upload_batch_size точек;
+# при таймауте кусок делится пополам, но не мельче UPSERT_MIN_BATCH_SIZE
+EMBED_BATCH_SIZE = 512
+UPSERT_MIN_BATCH_SIZE = 16
+
+# Поиск по квантованному ada-embedding: берём кандидатов с запасом и
+# пересчитываем их скор по полным векторам, чтобы не терять recall
+ADA_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
 
 # -------------------- Config --------------------
 # Конфигурация для OpenAI, Qdrant и Postgres
@@ -43,19 +74,109 @@ bm25_embedding_model = Bm25(
     **( {"specific_model_path": _bm25_model_path} if _bm25_model_path else {}),
 )
 
+# BM25 — чистый Python/NumPy под GIL, поток его только прячет от event loop.
+# При массовой загрузке считаем его в пуле процессов; пул создаётся лениво
+_bm25_executor: ProcessPoolExecutor | None = None
+
+
+def _get_bm25_executor() -> ProcessPoolExecutor:
+    global _bm25_executor
+    if _bm25_executor is None:
+        _bm25_executor = ProcessPoolExecutor(
+            max_workers=settings.bm25_workers,
+            # spawn: fork процесса uvicorn с живыми потоками небезопасен
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_bm25,
+            initargs=(_bm25_model_path,),
+        )
+    return _bm25_executor
+
+
+def shutdown_bm25_executor() -> None:
+    """Останавливает пул процессов BM25, если он был создан."""
+    global _bm25_executor
+    if _bm25_executor is not None:
+        _bm25_executor.shutdown(wait=True, cancel_futures=True)
+        _bm25_executor = None
+
+
+async def bm25_passage_embed(texts: list[str]) -> list[dict[str, Any]]:
+    """Sparse BM25-векторы для загрузки, вне event loop.
+
+    При settings.bm25_workers == 0 считает в потоке, иначе — в пуле процессов.
+    """
+    if settings.bm25_workers <= 0:
+        return await asyncio.to_thread(
+            lambda: [emb.as_object() for emb in bm25_embedding_model.passage_embed(texts)]
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_bm25_executor(), embed_passages, texts)
+
+
+# Пул keep-alive соединений к OpenAI: параллельные батчи эмбеддингов
+# мультиплексируются по HTTP/2 (h2 — из extra httpx[http2]) без новых TLS-рукопожатий
+OPENAI_HTTP_LIMITS = httpx.Limits(
+    max_connections=64,
+    max_keepalive_connections=32,
+    keepalive_expiry=60.0,
+)
+
 # Асинхронный клиент OpenAI с использованием httpx
 openai_client = AsyncOpenAI(
     api_key=OPENAI_API_KEY,
-    http_client=httpx.AsyncClient(proxy=OPENAI_PROXY, timeout=OPENAI_TIMEOUT),
+    http_client=httpx.AsyncClient(
+        proxy=OPENAI_PROXY,
+        timeout=OPENAI_TIMEOUT,
+        http2=True,
+        limits=OPENAI_HTTP_LIMITS,
+    ),
 )
 
 # Асинхронный клиент Qdrant для работы с векторной базой данных
 qdrant_client = AsyncQdrantClient(
-    QDRANT_URL, timeout=QDRANT_TIMEOUT, check_compatibility=False
+    QDRANT_URL,
+    timeout=QDRANT_TIMEOUT,
+    check_compatibility=False,
+    prefer_grpc=settings.qdrant_prefer_grpc,
+    grpc_port=settings.qdrant_grpc_port,
 )
 
 
 # -------------------- Retry helper --------------------
+# Сетевые сбои, таймауты, 429 и 5xx — временные, их имеет смысл повторять.
+# Остальное (4xx, ошибки в коде) повтор не исправит
+# Коды gRPC (qdrant_prefer_grpc=True), при которых запрос к Qdrant стоит повторить
+_GRPC_RETRYABLE_CODES = frozenset(
+    {
+        StatusCode.UNAVAILABLE,
+        StatusCode.DEADLINE_EXCEEDED,
+        StatusCode.RESOURCE_EXHAUSTED,
+        StatusCode.ABORTED,
+    }
+)
+
+
+def _is_retryable(e: Exception) -> bool:
+    """Проверяет, что ошибка временная и запрос стоит повторить."""
+    if isinstance(e, AioRpcError):
+        return e.code() in _GRPC_RETRYABLE_CODES
+    if isinstance(
+        e,
+        (
+            asyncio.TimeoutError,
+            httpx.TransportError,
+            ResponseHandlingException,
+            openai.APIConnectionError,
+        ),
+    ):
+        return True
+    if isinstance(e, UnexpectedResponse):
+        return e.status_code is None or e.status_code == 429 or e.status_code >= 500
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
 # Универсальная функция с повторной попыткой ТОЛЬКО для асинхронных функций
 async def retry_request(
     func: Callable[..., Union[T, Awaitable[T]]],  # допускает обычный и async вызов
@@ -64,7 +185,11 @@ async def retry_request(
     backoff: float = RETRY_BACKOFF,
     **kwargs: Any,
 ) -> T:
-    """Функция повтора."""
+    """Функция повтора.
+
+    Повторяет только временные ошибки (см. _is_retryable); пауза — full jitter
+    от backoff**attempt, не больше RETRY_MAX_WAIT секунд.
+    """
     for attempt in range(1, retries + 1):
         try:
             result = func(*args, **kwargs)
@@ -72,10 +197,13 @@ async def retry_request(
                 return await result  # awaitable coroutine
             return result  # обычная функция
         except Exception as e:
+            if not _is_retryable(e):
+                logger.exception("retry.not_retryable", func=func.__name__, error=str(e))
+                raise
             if attempt == retries:
                 logger.exception("retry.exhausted", func=func.__name__, error=str(e))
                 raise
-            wait = backoff**attempt + random.uniform(0, 1)
+            wait = min(RETRY_MAX_WAIT, backoff**attempt) * random.random()
             logger.warning(
                 "retry.attempt", func=func.__name__, error=str(e), attempt=attempt, retries=retries, wait=round(wait, 1)
             )
@@ -86,10 +214,17 @@ async def retry_request(
 
 # -------------------- Batch helper --------------------
 # Генератор для разбиения любого итерируемого объекта на батчи заданного размера
-def batch_iterable(iterable: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+def batch_iterable(iterable: Iterable[T], size: int) -> Iterator[Sequence[T]]:
     """Генератор для разбиения любого итерируемого объекта на батчи заданного размера."""
-    for i in range(0, len(iterable), size):
-        yield iterable[i : i + size]
+    # Последовательности (list, tuple) режем срезами
+    if isinstance(iterable, Sequence):
+        for i in range(0, len(iterable), size):
+            yield iterable[i : i + size]
+        return
+    # Генераторы и курсоры читаются потоком, без материализации целиком
+    it = iter(iterable)
+    while batch := list(islice(it, size)):
+        yield batch
 
 
 # -------------------- Embeddings --------------------
@@ -123,7 +258,134 @@ async def ada_embeddings(
     return await embed_texts(texts, model=model)
 
 
+def _open_embedding_cache() -> EmbeddingCache | None:
+    if not settings.embedding_cache_path:
+        return None
+    try:
+        return EmbeddingCache(
+            settings.embedding_cache_path, settings.embedding_cache_max_entries
+        )
+    except Exception as e:
+        # Без кэша всё работает, просто дороже — не роняем импорт модуля
+        logger.warning("embedding_cache.unavailable", path=settings.embedding_cache_path, error=str(e))
+        return None
+
+
+_embedding_cache = _open_embedding_cache()
+
+
+async def cached_ada_embeddings(
+    texts: list[str], model: str = "text-embedding-ada-002"
+) -> list[list[float]]:
+    """ada_embeddings с дисковым кэшем: в OpenAI уходят только новые тексты.
+
+    Тексты должны быть непустыми — иначе embed_texts их выбросит и порядок
+    векторов разойдётся с порядком текстов.
+    """
+    if _embedding_cache is None:
+        return await ada_embeddings(texts, model=model)
+
+    cache = _embedding_cache
+    keys = [cache.key(model, t) for t in texts]
+    # Ошибка кэша (sqlite "database is locked" у соседнего воркера, нет места
+    # на диске) не должна ронять пересборку: чтение считается промахом,
+    # запись пропускается
+    try:
+        found = await asyncio.to_thread(cache.get_many, keys)
+    except sqlite3.Error as e:
+        logger.warning("embedding_cache.read_failed", error=str(e))
+        found = {}
+
+    # Промахи без дублей, в порядке первого появления
+    missing = {k: t for k, t in zip(keys, texts) if k not in found}
+    if missing:
+        vectors = await ada_embeddings(list(missing.values()), model=model)
+        fresh = dict(zip(missing, vectors))
+        try:
+            await asyncio.to_thread(cache.put_many, fresh)
+        except sqlite3.Error as e:
+            logger.warning("embedding_cache.write_failed", error=str(e))
+        found.update(fresh)
+    return [found[k] for k in keys]
+
+
+# -------------------- Query-side embeddings --------------------
+# Пользовательские запросы сильно повторяются ("массаж", "маникюр", ...):
+# вектор частого запроса берём из памяти, а не из OpenAI
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_TTL = 24 * 3600
+_query_ada_cache: TTLCache[str, list[float]] = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+
+async def query_ada_embedding(query: str) -> list[float]:
+    """Dense-вектор поискового запроса с in-memory LRU-кэшем."""
+    vector = _query_ada_cache.get(query)
+    if vector is None:
+        vector = (await ada_embeddings([query]))[0]
+        _query_ada_cache.set(query, vector)
+    return vector
+
+
+async def query_ada_embeddings(queries: list[str]) -> list[list[float]]:
+    """Dense-векторы нескольких непустых запросов: из кэша, промахи — одним запросом к OpenAI."""
+    found: dict[str, list[float]] = {}
+    for q in queries:
+        vector = _query_ada_cache.get(q)
+        if vector is not None:
+            found[q] = vector
+    missing = list(dict.fromkeys(q for q in queries if q not in found))
+    if missing:
+        for q, vector in zip(missing, await ada_embeddings(missing)):
+            _query_ada_cache.set(q, vector)
+            found[q] = vector
+    return [found[q] for q in queries]
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def query_bm25(query: str) -> dict[str, Any]:
+    """Sparse BM25-вектор поискового запроса (чистый CPU, кэшируется целиком).
+
+    Результат общий для всех вызовов — его нельзя изменять.
+    """
+    return next(bm25_embedding_model.query_embed(query)).as_object()
+
+
 # -------------------- Reset collection --------------------
+# Параметры коллекций: по ним reset_collection создаёт коллекцию, а
+# collection_schema_matches проверяет, что существующая создана так же
+HNSW_CONFIG = models.HnswConfigDiff(
+    m=HNSW_M,  # параметр HNSW: количество соседей для построения графа
+    ef_construct=200,  # точность построения индекса
+    full_scan_threshold=50000,  # порог для полного сканирования вместо индекса
+    max_indexing_threads=4,  # количество потоков для индексации
+)
+ADA_VECTOR_PARAMS = models.VectorParams(
+    size=1536,  # размерность эмбеддинга
+    distance=models.Distance.COSINE,  # метрика косинусного сходства
+    datatype=models.Datatype.FLOAT16,  # тип хранения
+    # int8-копия векторов в RAM для быстрого поиска; точный скор
+    # пересчитывается по исходным векторам (см. ADA_SEARCH_PARAMS)
+    quantization_config=models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8,
+            quantile=0.99,
+            always_ram=True,
+        )
+    ),
+)
+BM25_VECTOR_PARAMS = models.SparseVectorParams(
+    modifier=models.Modifier.IDF,  # модификатор BM25
+    index=models.SparseIndexParams(),  # параметры sparse индекса
+)
+TEXT_INDEX_PARAMS = models.TextIndexParams(
+    type=models.TextIndexType.TEXT,
+    tokenizer=models.TokenizerType.WORD,
+    min_token_len=1,
+    max_token_len=15,
+    lowercase=True,
+)
+
+
 # Функция для удаления и создания коллекции в Qdrant с настройкой векторов и индексов
 async def reset_collection(
     client: AsyncQdrantClient,
@@ -141,40 +403,221 @@ async def reset_collection(
     # Создаем новую коллекцию с конфигурацией HNSW и векторных пространств
     await client.create_collection(
         collection_name,
-        hnsw_config=models.HnswConfigDiff(
-            m=32,  # параметр HNSW: количество соседей для построения графа
-            ef_construct=200,  # точность построения индекса
-            full_scan_threshold=50000,  # порог для полного сканирования вместо индекса
-            max_indexing_threads=4,  # количество потоков для индексации
-        ),
-        vectors_config={
-            "ada-embedding": models.VectorParams(
-                size=1536,  # размерность эмбеддинга
-                distance=models.Distance.COSINE,  # метрика косинусного сходства
-                datatype=models.Datatype.FLOAT16,  # тип хранения
-            ),
-        },
-        sparse_vectors_config={
-            "bm25": models.SparseVectorParams(
-                modifier=models.Modifier.IDF,  # модификатор BM25
-                index=models.SparseIndexParams(),  # параметры sparse индекса
-            ),
-        },
+        hnsw_config=HNSW_CONFIG,
+        vectors_config={"ada-embedding": ADA_VECTOR_PARAMS},
+        sparse_vectors_config={"bm25": BM25_VECTOR_PARAMS},
     )
     logger.info("qdrant.collection.created", collection=collection_name)
 
-    # Создаем текстовые индексы для указанных полей
+    # Создаем текстовые индексы для указанных полей — параллельно, поля независимы
     if text_index_fields:
-        for field in text_index_fields:
-            await client.create_payload_index(
+        await gather_or_cancel(
+            *(
+                client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=field,
+                    field_schema=TEXT_INDEX_PARAMS,
+                )
+                for field in text_index_fields
+            )
+        )
+        logger.info("qdrant.index.created", collection=collection_name, fields=text_index_fields)
+
+
+async def collection_schema_matches(
+    client: AsyncQdrantClient,
+    collection_name: str,
+    text_index_fields: list[str] | None = None,
+) -> bool:
+    """Проверяет, что существующая коллекция создана с текущими параметрами reset_collection.
+
+    Если параметры векторов, HNSW или текстовых индексов в коде поменялись,
+    коллекцию нужно пересоздать — инкрементальная загрузка их не применит.
+    """
+    info = await retry_request(client.get_collection, collection_name)
+    params = info.config.params
+    vectors = params.vectors if isinstance(params.vectors, dict) else {}
+    ada = vectors.get("ada-embedding")
+    bm25 = (params.sparse_vectors or {}).get("bm25")
+    hnsw = info.config.hnsw_config
+    payload_schema = info.payload_schema or {}
+
+    checks = {
+        "ada-embedding": ada is not None
+        and (ada.size, ada.distance, ada.datatype, ada.quantization_config)
+        == (
+            ADA_VECTOR_PARAMS.size,
+            ADA_VECTOR_PARAMS.distance,
+            ADA_VECTOR_PARAMS.datatype,
+            ADA_VECTOR_PARAMS.quantization_config,
+        ),
+        "bm25": bm25 is not None and bm25.modifier == BM25_VECTOR_PARAMS.modifier,
+        "hnsw": (hnsw.m, hnsw.ef_construct, hnsw.full_scan_threshold)
+        == (HNSW_CONFIG.m, HNSW_CONFIG.ef_construct, HNSW_CONFIG.full_scan_threshold),
+        "text_index": all(
+            field in payload_schema
+            and payload_schema[field].data_type == models.PayloadSchemaType.TEXT
+            for field in text_index_fields or []
+        ),
+    }
+    mismatched = [name for name, ok in checks.items() if not ok]
+    if mismatched:
+        logger.info(
+            "qdrant.collection.schema_changed",
+            collection=collection_name,
+            mismatched=mismatched,
+        )
+        return False
+    return True
+
+
+# -------------------- Bulk upload --------------------
+async def _as_async_iter(items: Iterable[T] | AsyncIterable[T]) -> AsyncIterator[T]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def run_batches(
+    batches: Iterable[T] | AsyncIterable[T],
+    process_batch: Callable[[T], Awaitable[int]],
+    desc: str,
+    parallel: int = settings.qdrant_upload_parallel,
+) -> int:
+    """Обрабатывает батчи загрузки с ограниченным параллелизмом.
+
+    Запросы к OpenAI, загрузка в Qdrant и BM25 разных батчей перекрываются,
+    но в полёте не больше parallel батчей; следующий батч берётся из источника
+    (в том числе из курсора Postgres), только когда освободился слот.
+    process_batch возвращает количество загруженных точек, функция — их сумму.
+    """
+    semaphore = asyncio.Semaphore(parallel)
+    progress = tqdm_asyncio(desc=desc)
+
+    async def _bounded(batch: T) -> int:
+        try:
+            uploaded = await process_batch(batch)
+        finally:
+            semaphore.release()
+        progress.update(1)
+        return uploaded
+
+    tasks: list[asyncio.Task[int]] = []
+    try:
+        # TaskGroup при ошибке батча отменяет остальные и чтение источника
+        async with asyncio.TaskGroup() as tg:
+            async for batch in _as_async_iter(batches):
+                await semaphore.acquire()
+                tasks.append(tg.create_task(_bounded(batch)))
+    except ExceptionGroup as eg:
+        # Наружу — первая ошибка батча, как при обычном await
+        raise eg.exceptions[0] from eg
+    finally:
+        progress.close()
+    return sum(task.result() for task in tasks)
+
+
+def _is_timeout(e: Exception) -> bool:
+    """Проверяет, что запрос к Qdrant не уложился в таймаут."""
+    if isinstance(e, AioRpcError):
+        return e.code() == StatusCode.DEADLINE_EXCEEDED
+    if isinstance(e, ResponseHandlingException):
+        e = e.source
+    return isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException))
+
+
+async def upsert_points(
+    collection_name: str,
+    ids: list[int],
+    vectors: dict[str, list[Any]],
+    payloads: list[dict[str, Any]],
+    batch_size: int | None = None,
+) -> int:
+    """Загружает точки в коллекцию кусками по batch_size с retry.
+
+    Точки передаются колонками (models.Batch): ids, векторы по имени и payload
+    выровнены по индексу. По умолчанию batch_size берётся из
+    settings.qdrant_upload_batch_size; если кусок не укладывается в таймаут
+    и после ретраев, он и все следующие грузятся вдвое меньшими кусками.
+    Возвращает количество загруженных точек.
+    """
+    size = batch_size or settings.qdrant_upload_batch_size
+    # upsert — нативно асинхронный; upload_points у AsyncQdrantClient синхронный
+    # (свой sync REST-клиент, а parallel>1 — отдельные процессы) и блокирует event loop
+    start = 0
+    while start < len(ids):
+        end = start + size
+        batch = models.Batch(
+            ids=ids[start:end],
+            vectors={name: vecs[start:end] for name, vecs in vectors.items()},
+            payloads=payloads[start:end],
+        )
+        try:
+            await retry_request(
+                qdrant_client.upsert,
                 collection_name=collection_name,
-                field_name=field,
-                field_schema=models.TextIndexParams(
-                    type=models.TextIndexType.TEXT,
-                    tokenizer=models.TokenizerType.WORD,
-                    min_token_len=1,
-                    max_token_len=15,
-                    lowercase=True,
-                ),
+                points=batch,
+                wait=False,
+            )
+        except Exception as e:
+            if size <= UPSERT_MIN_BATCH_SIZE or not _is_timeout(e):
+                raise
+            size = max(UPSERT_MIN_BATCH_SIZE, size // 2)
+            logger.warning(
+                "qdrant.upload.batch_shrink",
+                collection=collection_name,
+                batch_size=size,
+                error=str(e),
+            )
+            continue
+        start = end
+    return len(ids)
+
+
+# На время массовой загрузки отключаем построение HNSW-графа (m=0), чтобы Qdrant
+# не перестраивал индекс после каждого батча; граф строится один раз в конце
+@asynccontextmanager
+async def deferred_hnsw_indexing(
+    client: AsyncQdrantClient, collection_name: str
+) -> AsyncIterator[None]:
+    """Отключает HNSW-индексацию коллекции на время блока и включает её обратно."""
+    await client.update_collection(
+        collection_name, hnsw_config=models.HnswConfigDiff(m=0)
+    )
+    try:
+        yield
+    finally:
+        await client.update_collection(
+            collection_name, hnsw_config=models.HnswConfigDiff(m=HNSW_M)
+        )
+        logger.info("qdrant.indexing.enabled", collection=collection_name)
+
+
+# Загрузка идёт с wait=False: Qdrant подтверждает приём батча, не дожидаясь его
+# применения. Перед чтением коллекции ждём, пока все точки станут видны
+async def wait_for_points(
+    client: AsyncQdrantClient,
+    collection_name: str,
+    expected: int,
+    timeout: float = 30.0,
+    interval: float = 0.2,
+) -> bool:
+    """Ждёт, пока в коллекции окажется не меньше expected точек."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        result = await client.count(collection_name, exact=True)
+        if result.count >= expected:
+            return True
+        if loop.time() >= deadline:
+            logger.warning(
+                "qdrant.upload.wait_timeout",
+                collection=collection_name,
+                expected=expected,
+                count=result.count,
             )
-            logger.info("qdrant.index.created", collection=collection_name, field=field)
+            return False
+        await asyncio.sleep(interval)
@@ -10,23 +10,30 @@
 Примечание: Пересоздается коллекция полностью!!! Нужно переделать частичное по channel_id.
 """
 
-from typing import Any
+import functools
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import aclosing
+from typing import Sequence
 
 import asyncpg  # Асинхронный клиент для PostgreSQL
-from qdrant_client import models  # Модели для работы с точками Qdrant
-from tqdm.asyncio import tqdm_asyncio  # Асинхронный прогресс-бар для итераций
 
+from ..common import gather_or_cancel, prepend_async  # type: ignore
 from ..settings import settings  # type: ignore
 from ..zena_logging import get_logger  # type: ignore
 
+from .postgres_common import fetch_batches  # Чтение Postgres курсором
+
 # Импорт общих клиентов и функций из модуля zena_qdrant
 from .qdrant_common import (
-    ada_embeddings,  # Dense embedding через OpenAI
-    batch_iterable,  # Разбивка данных на батчи
-    bm25_embedding_model,  # Sparse BM25 embedding
+    EMBED_BATCH_SIZE,  # Размер батча эмбеддингов
+    bm25_passage_embed,  # Sparse BM25 embedding вне event loop
+    cached_ada_embeddings,  # Dense embedding через OpenAI с дисковым кэшем
+    deferred_hnsw_indexing,  # Отключение HNSW на время загрузки
     qdrant_client,  # Асинхронный клиент Qdrant
     reset_collection,  # Сброс/создание коллекции
-    retry_request,  # Retry helper для надежной загрузки
+    run_batches,  # Параллельная обработка батчей загрузки
+    upsert_points,  # Загрузка точек кусками с retry
+    wait_for_points,  # Ожидание применения загрузки с wait=False
 )
 
 # Импорт функции для поиска FAQ по гибридной модели
@@ -47,17 +54,23 @@ async def qdrant_create_faq_async(pool: asyncpg.Pool) -> bool:  # type: ignore[t
     3. Загружает FAQ в коллекцию
     4. Проверяет работу поиска с тестовым запросом
     """
-    # Шаг 1: Загрузка данных из Postgres
-    docs = await faq_load_from_postgres(pool)
-    if not docs:
-        logger.warning("qdrant.upload.empty", collection=QDRANT_COLLECTION)
-        return False
-
-    # Шаг 2: Сброс и создание коллекции в Qdrant
-    await reset_collection(qdrant_client, QDRANT_COLLECTION)
-
-    # Шаг 3: Загрузка данных в коллекцию
-    await fill_collection_faq(docs, QDRANT_COLLECTION)
+    # Шаг 1: Чтение FAQ из Postgres курсором — батчи уходят в эмбеддинг,
+    # пока Postgres досылает остальное
+    async with aclosing(faq_load_from_postgres(pool)) as batches:
+        first = await anext(batches, None)
+        if first is None:
+            logger.warning("qdrant.upload.empty", collection=QDRANT_COLLECTION)
+            return False
+
+        # Шаг 2: Сброс и создание коллекции в Qdrant
+        await reset_collection(qdrant_client, QDRANT_COLLECTION)
+
+        # Шаг 3: Загрузка данных в коллекцию (HNSW-граф строится после загрузки)
+        async with deferred_hnsw_indexing(qdrant_client, QDRANT_COLLECTION):
+            uploaded = await fill_collection_faq(
+                prepend_async(first, batches), QDRANT_COLLECTION
+            )
+    await wait_for_points(qdrant_client, QDRANT_COLLECTION, uploaded)
 
     # Шаг 4: Проверка работы поиска с тестовым запросом
     results = await retriver_hybrid_async("Абонемент", QDRANT_COLLECTION)
@@ -68,67 +81,74 @@ async def qdrant_create_faq_async(pool: asyncpg.Pool) -> bool:  # type: ignore[t
 
 
 # -------------------- Загрузка FAQ из Postgres --------------------
-async def faq_load_from_postgres(pool: asyncpg.Pool) -> list[dict[str, Any]]:  # type: ignore[type-arg]
-    """Загружает все записи FAQ из таблицы 'faq' в Postgres.
-
-    Возвращает список словарей с ключами:
+def faq_load_from_postgres(
+    pool: asyncpg.Pool,  # type: ignore[type-arg]
+    batch_size: int = EMBED_BATCH_SIZE,
+) -> AsyncGenerator[list[asyncpg.Record], None]:
+    """Читает записи FAQ из таблицы 'faq' в Postgres батчами по batch_size.
+
+    Строки идут серверным курсором, таблица целиком в память не загружается.
+    Каждая запись — asyncpg.Record с ключами:
     channel_id, id, topic, question, answer
     """
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            "SELECT channel_id, id, topic, question, answer FROM faq"
-        )
-        # Преобразуем строки в список словарей
-        return [dict(r) for r in rows]
+    return fetch_batches(
+        pool,
+        "SELECT channel_id, id, topic, question, answer FROM faq",
+        batch_size=batch_size,
+    )
 
 
 # -------------------- Загрузка FAQ в Qdrant --------------------
+async def _process_batch_faq(batch: Sequence[asyncpg.Record], collection_name: str) -> int:
+    """Считает эмбеддинги одного батча FAQ и загружает его в Qdrant.
+
+    Возвращает количество загруженных точек.
+    """
+    # Фильтруем записи без вопросов
+    filtered = [d for d in batch if (d["question"] or "").strip()]
+    if not filtered:
+        return 0
+
+    # Получаем список вопросов
+    questions = [d["question"] for d in filtered]
+
+    # ---------------- Embeddings ----------------
+    # Sparse BM25 (fastembed, CPU-bound — вне event loop) и dense OpenAI
+    # считаются одновременно
+    bm25_emb, ada_emb = await gather_or_cancel(
+        bm25_passage_embed(questions), cached_ada_embeddings(questions)
+    )
+
+    # ---------------- Формирование точек Qdrant ----------------
+    # Точки колонками (models.Batch), без PointStruct на каждую запись; upsert с retry
+    return await upsert_points(
+        collection_name,
+        ids=[int(d["id"]) for d in filtered],  # Используем id из БД как идентификатор точки
+        vectors={"ada-embedding": ada_emb, "bm25": bm25_emb},  # Dense и sparse векторы
+        payloads=[dict(d) for d in filtered],  # Сохраняем всю запись как payload
+    )
+
+
 async def fill_collection_faq(
-    docs: list[dict[str, Any]], collection_name: str, batch_size: int = 64
-) -> None:
+    batches: AsyncIterator[Sequence[asyncpg.Record]],
+    collection_name: str,
+    parallel: int = settings.qdrant_upload_parallel,
+) -> int:
     """Загружает FAQ в коллекцию Qdrant.
 
     Для каждой записи создаются два типа эмбеддингов:
         - BM25 (sparse)
         - OpenAI ADA (dense)
-    docs: список словарей FAQ
+    batches: асинхронный поток батчей FAQ (см. faq_load_from_postgres)
     collection_name: название коллекции Qdrant
-    batch_size: размер батча для пакетной загрузки
-    """
-    logger.info("qdrant.upload.started", count=len(docs), collection=collection_name)
-
-    # Разбиваем данные на батчи и отображаем прогресс
-    for batch in tqdm_asyncio(batch_iterable(docs, batch_size), desc="FAQ batches"):
-        # Фильтруем записи без вопросов
-        filtered = [d for d in batch if d.get("question", "").strip()]
-        if not filtered:
-            continue
-
-        # Получаем список вопросов
-        questions = [d["question"] for d in filtered]
-
-        # ---------------- Embeddings ----------------
-        # Sparse BM25 embeddings (fastembed)
-        bm25_emb = list(bm25_embedding_model.passage_embed(questions))
-        # Dense OpenAI embeddings
-        ada_emb = await ada_embeddings(questions)
-
-        # ---------------- Формирование точек Qdrant ----------------
-        points = [
-            models.PointStruct(
-                id=int(d["id"]),  # Используем id из БД как идентификатор точки
-                vector={
-                    "ada-embedding": ada_emb[i],  # Dense вектор
-                    "bm25": bm25_emb[i].as_object(),  # Sparse вектор
-                },
-                payload=d,  # Сохраняем всю запись как payload
-            )
-            for i, d in enumerate(filtered)
-        ]
-
-        # Загружаем точки в коллекцию с retry для надёжности
-        await retry_request(
-            qdrant_client.upload_points, collection_name=collection_name, points=points
-        )
-
+    parallel: сколько батчей обрабатывается одновременно
 
+    Возвращает количество загруженных точек.
+    """
+    logger.info("qdrant.upload.started", collection=collection_name)
+    return await run_batches(
+        batches,
+        functools.partial(_process_batch_faq, collection_name=collection_name),
+        desc="FAQ batches",
+        parallel=parallel,
+    )
@@ -1,20 +1,30 @@
 """Модуль реализует процесс создания коллекции для поиска услуг/продуктов."""
 
-from typing import Any
+import functools
+import hashlib
+from collections.abc import AsyncGenerator, AsyncIterator, Mapping
+from contextlib import aclosing
+from typing import Any, Sequence
 
 import asyncpg  # Асинхронный клиент для PostgreSQL
 from qdrant_client import models  # Модели для работы с Qdrant
-from tqdm.asyncio import tqdm_asyncio  # Асинхронный прогресс-бар
 
+from ..common import gather_or_cancel, prepend_async  # type: ignore
 from ..settings import settings  # type: ignore
 from ..zena_logging import get_logger  # type: ignore
+from .postgres_common import fetch_batches  # Чтение Postgres курсором
 from .qdrant_common import (
-    ada_embeddings,  # Dense embeddings через OpenAI
-    batch_iterable,  # Генератор для разбивки на батчи
-    bm25_embedding_model,  # BM25 sparse embedding
+    EMBED_BATCH_SIZE,  # Размер батча эмбеддингов
+    bm25_passage_embed,  # Sparse BM25 embedding вне event loop
+    cached_ada_embeddings,  # Dense embedding через OpenAI с дисковым кэшем
+    collection_schema_matches,  # Сверка схемы коллекции с reset_collection
+    deferred_hnsw_indexing,  # Отключение HNSW на время загрузки
     qdrant_client,  # Асинхронный клиент Qdrant
     reset_collection,  # Функция сброса/создания коллекции
     retry_request,  # Retry helper для надёжного выполнения
+    run_batches,  # Параллельная обработка батчей загрузки
+    upsert_points,  # Загрузка точек кусками с retry
+    wait_for_points,  # Ожидание применения загрузки с wait=False
 )
 from .qdrant_retriever_product import retriever_product_hybrid_async
 
@@ -33,27 +43,63 @@ TEXT_INDEX_FIELDS = [
 
 
 # -------------------- Главная асинхронная функция --------------------
-async def qdrant_create_products_async(pool: asyncpg.Pool) -> bool:  # type: ignore[type-arg]
+async def qdrant_create_products_async(
+    pool: asyncpg.Pool,  # type: ignore[type-arg]
+    full_rebuild: bool = False,
+) -> bool:
     """Главная функция для создания коллекции продуктов в Qdrant.
 
     1. Загружает продукты из Postgres
     2. Сбрасывает/создаёт коллекцию Qdrant с текстовыми индексами
-    3. Загружает продукты в коллекцию с эмбеддингами
+       (только если коллекции нет, её схема устарела или запрошена полная пересборка)
+    3. Загружает в коллекцию с эмбеддингами новые и изменённые продукты,
+       удаляет пропавшие
     4. Проверяет работу поиска через retriver_product_hybrid_async
     """
-    # Шаг 1: Загрузка данных
-    docs = await products_load_from_postgres(pool)
-    if not docs:
-        logger.warning("qdrant.upload.empty", collection=QDRANT_COLLECTION)
-        return False
-
-    # Шаг 2: Сброс и создание коллекции с текстовыми индексами
-    await reset_collection(
-        qdrant_client, QDRANT_COLLECTION, text_index_fields=TEXT_INDEX_FIELDS
-    )
+    # Шаг 1: Чтение продуктов из Postgres курсором
+    async with aclosing(products_load_from_postgres(pool)) as batches:
+        first = await anext(batches, None)
+        if first is None:
+            logger.warning("qdrant.upload.empty", collection=QDRANT_COLLECTION)
+            return False
+        source = prepend_async(first, batches)
+
+        known_hashes = (
+            None if full_rebuild else await _load_content_hashes(QDRANT_COLLECTION)
+        )
+        if known_hashes is None:
+            # Шаг 2: Сброс и создание коллекции с текстовыми индексами
+            await reset_collection(
+                qdrant_client, QDRANT_COLLECTION, text_index_fields=TEXT_INDEX_FIELDS
+            )
 
-    # Шаг 3: Загрузка данных в коллекцию
-    await fill_collection_products(docs, QDRANT_COLLECTION)
+            # Шаг 3: Загрузка данных в коллекцию (HNSW-граф строится после загрузки)
+            async with deferred_hnsw_indexing(qdrant_client, QDRANT_COLLECTION):
+                expected = await fill_collection_products(
+                    _with_content_hash(source, {}, set()), QDRANT_COLLECTION
+                )
+        else:
+            # Шаг 3: Инкрементальное обновление — эмбеддим только изменённые строки
+            seen_ids: set[int] = set()
+            await fill_collection_products(
+                _with_content_hash(source, known_hashes, seen_ids), QDRANT_COLLECTION
+            )
+            stale_ids = [pid for pid in known_hashes if pid not in seen_ids]
+            if stale_ids:
+                await retry_request(
+                    qdrant_client.delete,
+                    collection_name=QDRANT_COLLECTION,
+                    points_selector=models.PointIdsList(points=stale_ids),
+                )
+            logger.info(
+                "qdrant.upload.incremental",
+                collection=QDRANT_COLLECTION,
+                total=len(seen_ids),
+                deleted=len(stale_ids),
+            )
+            expected = len(seen_ids)
+    # upsert идёт с wait=False: перед проверкой поиска ждём применения точек
+    await wait_for_points(qdrant_client, QDRANT_COLLECTION, expected)
 
     # Шаг 4: Проверка поиска (пример запроса)
     results = await retriever_product_hybrid_async(1, "массаж")
@@ -64,62 +110,134 @@ async def qdrant_create_products_async(pool: asyncpg.Pool) -> bool:  # type: ign
 
 
 # -------------------- Загрузка продуктов из Postgres --------------------
-async def products_load_from_postgres(pool: asyncpg.Pool) -> list[dict[str, Any]]:  # type: ignore[type-arg]
-    """Загружает все продукты и услуги из представления product_service_view в Postgres.
+def products_load_from_postgres(
+    pool: asyncpg.Pool,  # type: ignore[type-arg]
+    batch_size: int = EMBED_BATCH_SIZE,
+) -> AsyncGenerator[list[asyncpg.Record], None]:
+    """Читает все продукты и услуги из представления product_service_view в Postgres.
+
+    Строки идут серверным курсором батчами по batch_size; каждая запись —
+    asyncpg.Record со всеми колонками представления.
+    """
+    return fetch_batches(pool, "SELECT * FROM product_service_view", batch_size=batch_size)
+
+
+# -------------------- Инкрементальное обновление --------------------
+def _content_hash(doc: Mapping[str, Any]) -> str:
+    """Хэш содержимого строки: совпал с сохранённым в payload — строка не менялась."""
+    return hashlib.blake2b(
+        repr(sorted(doc.items())).encode(), digest_size=16
+    ).hexdigest()
+
+
+async def _load_content_hashes(collection_name: str) -> dict[int, str] | None:
+    """Читает {id: content_hash} всех точек коллекции.
+
+    Возвращает None, если коллекции нет или она создана с устаревшими
+    параметрами (векторы, HNSW, текстовые индексы) — тогда нужна полная пересборка.
+    """
+    if not await retry_request(qdrant_client.collection_exists, collection_name):
+        return None
+    if not await collection_schema_matches(
+        qdrant_client, collection_name, TEXT_INDEX_FIELDS
+    ):
+        return None
+    hashes: dict[int, str] = {}
+    offset = None
+    while True:
+        points, offset = await retry_request(
+            qdrant_client.scroll,
+            collection_name,
+            limit=1024,
+            offset=offset,
+            with_payload=["content_hash"],
+            with_vectors=False,
+        )
+        for point in points:
+            hashes[int(point.id)] = (point.payload or {}).get("content_hash", "")
+        if offset is None:
+            return hashes
+
+
+async def _with_content_hash(
+    batches: AsyncIterator[list[asyncpg.Record]],
+    known_hashes: dict[int, str],
+    seen_ids: set[int],
+) -> AsyncIterator[list[dict[str, Any]]]:
+    """Превращает записи в payload-словари с content_hash, пропуская уже загруженные.
 
-    Возвращает список словарей, где каждая запись содержит все колонки из представления.
+    Id всех прочитанных записей складываются в seen_ids — по ним потом
+    находятся точки удалённых продуктов.
     """
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""SELECT * FROM product_service_view""")
-        return [dict(r) for r in rows]  # Преобразуем результат в список словарей
+    async for batch in batches:
+        changed = []
+        for r in batch:
+            # Без текста для поиска точка не создаётся; старая, если была, удалится
+            if not (r["product_search"] or "").strip():
+                continue
+            content_hash = _content_hash(r)
+            pid = int(r["id"])
+            seen_ids.add(pid)
+            if known_hashes.get(pid) != content_hash:
+                # dict строится только для записей, которые пойдут в payload
+                changed.append({**r, "content_hash": content_hash})
+        if changed:
+            yield changed
 
 
 # -------------------- Загрузка продуктов в Qdrant --------------------
+async def _process_batch_products(
+    batch: Sequence[dict[str, Any]], collection_name: str
+) -> int:
+    """Считает эмбеддинги одного батча продуктов и загружает его в Qdrant.
+
+    Возвращает количество загруженных точек.
+    """
+    # Фильтруем записи без текста для поиска
+    filtered = [d for d in batch if (d["product_search"] or "").strip()]
+    if not filtered:
+        return 0
+
+    # Получаем список текстов для эмбеддинга
+    searches = [d["product_search"] for d in filtered]
+
+    # -------------------- Эмбеддинги --------------------
+    # Sparse BM25 (fastembed, CPU-bound — вне event loop) и dense OpenAI
+    # считаются одновременно
+    bm25_emb, ada_emb = await gather_or_cancel(
+        bm25_passage_embed(searches), cached_ada_embeddings(searches)
+    )
+
+    # -------------------- Формирование точек Qdrant --------------------
+    # Точки колонками (models.Batch), без PointStruct на каждую запись; upsert с retry
+    return await upsert_points(
+        collection_name,
+        ids=[int(d["id"]) for d in filtered],  # ID точки соответствует ID продукта
+        vectors={"ada-embedding": ada_emb, "bm25": bm25_emb},  # Dense и sparse векторы
+        payloads=filtered,  # Полная запись сохраняется в payload
+    )
+
+
 async def fill_collection_products(
-    docs: list[dict[str, Any]], collection_name: str, batch_size: int = 64
-) -> None:
+    batches: AsyncIterator[Sequence[dict[str, Any]]],
+    collection_name: str,
+    parallel: int = settings.qdrant_upload_parallel,
+) -> int:
     """Загружает данные о продуктах в коллекцию Qdrant.
 
     Для каждой записи создаются два вида эмбеддингов:
         - BM25 (sparse)
         - OpenAI ADA (dense)
-    docs: список словарей с продуктами
+    batches: асинхронный поток батчей продуктов (см. products_load_from_postgres)
     collection_name: название коллекции Qdrant
-    batch_size: размер батча для пакетной загрузки
-    """
-    logger.info("qdrant.upload.started", count=len(docs), collection=collection_name)
-
-    # Разбиваем данные на батчи и отображаем прогресс
-    for batch in tqdm_asyncio(
-        batch_iterable(docs, batch_size), desc="Products batches"
-    ):
-        # Фильтруем записи без текста для поиска
-        filtered = [d for d in batch if d.get("product_search", "").strip()]
-        if not filtered:
-            continue
-
-        # Получаем список текстов для эмбеддинга
-        searches = [d["product_search"] for d in filtered]
-
-        # -------------------- Эмбеддинги --------------------
-        # Sparse BM25 embeddings
-        bm25_emb = list(bm25_embedding_model.passage_embed(searches))
-        # Dense OpenAI embeddings
-        ada_emb = await ada_embeddings(searches)
-
-        # -------------------- Формирование точек Qdrant --------------------
-        points = [
-            models.PointStruct(
-                id=int(d["id"]),  # ID точки соответствует ID продукта
-                vector={"ada-embedding": ada_emb[i], "bm25": bm25_emb[i].as_object()},
-                payload=d,  # Полная запись сохраняется в payload
-            )
-            for i, d in enumerate(filtered)
-        ]
-
-        # Загружаем точки в коллекцию с retry для надёжности
-        await retry_request(
-            qdrant_client.upload_points, collection_name=collection_name, points=points
-        )
-
+    parallel: сколько батчей обрабатывается одновременно
 
+    Возвращает количество загруженных точек.
+    """
+    logger.info("qdrant.upload.started", collection=collection_name)
+    return await run_batches(
+        batches,
+        functools.partial(_process_batch_products, collection_name=collection_name),
+        desc="Products batches",
+        parallel=parallel,
+    )
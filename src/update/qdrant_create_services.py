@@ -10,23 +10,30 @@
 Примечание: Пересоздается коллекция полностью!!! Нужно переделать частичное по channel_id.
 """
 
-from typing import Any
+import functools
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import aclosing
+from typing import Sequence
 
 import asyncpg  # Асинхронный клиент для PostgreSQL
-from qdrant_client import models  # Модели и структуры для работы с Qdrant
-from tqdm.asyncio import tqdm_asyncio  # Асинхронный прогресс-бар для итераций
 
+from ..common import gather_or_cancel, prepend_async  # type: ignore
 from ..settings import settings  # type: ignore
 from ..zena_logging import get_logger  # type: ignore
 
+from .postgres_common import fetch_batches  # Чтение Postgres курсором
+
 # Импорт общих клиентов и функций из модуля zena_qdrant
 from .qdrant_common import (
-    ada_embeddings,  # Dense embedding через OpenAI
-    batch_iterable,  # Разбивка данных на батчи
-    bm25_embedding_model,  # Sparse BM25 embedding
+    EMBED_BATCH_SIZE,  # Размер батча эмбеддингов
+    bm25_passage_embed,  # Sparse BM25 embedding вне event loop
+    cached_ada_embeddings,  # Dense embedding через OpenAI с дисковым кэшем
+    deferred_hnsw_indexing,  # Отключение HNSW на время загрузки
     qdrant_client,  # Асинхронный клиент Qdrant
     reset_collection,  # Сброс/создание коллекции
-    retry_request,  # Retry helper для надежной загрузки
+    run_batches,  # Параллельная обработка батчей загрузки
+    upsert_points,  # Загрузка точек кусками с retry
+    wait_for_points,  # Ожидание применения загрузки с wait=False
 )
 
 # Импорт функции для поиска FAQ по гибридной модели
@@ -52,19 +59,28 @@ async def qdrant_create_services_async(
 
     logger.info("qdrant_create_services_async")
     logger.info("Шаг 1: Загрузка данных из Postgres")
-    # Шаг 1: Загрузка данных из Postgres
-    docs = await services_load_from_postgres(channel_id=channel_id, pool=pool)
-    if not docs:
-        logger.warning("qdrant.upload.empty", collection=collection_name)
-        return False
-
-    logger.info("Шаг 2: Сброс и создание коллекции")
-    # Шаг 2: Сброс и создание коллекции
-    await reset_collection(qdrant_client, collection_name)
-
-    logger.info("Шаг 3: Загрузка данных в коллекцию")
-    # Шаг 3: Загрузка данных в коллекцию
-    await fill_collection_services(docs, collection_name)
+    # Шаг 1: Чтение сервисов из Postgres курсором
+    async with aclosing(
+        services_load_from_postgres(channel_id=channel_id, pool=pool)
+    ) as batches:
+        first = await anext(batches, None)
+        if first is None:
+            logger.warning("qdrant.upload.empty", collection=collection_name)
+            return False
+
+        logger.info("Шаг 2: Сброс и создание коллекции")
+        # Шаг 2: Сброс и создание коллекции
+        await reset_collection(qdrant_client, collection_name)
+
+        logger.info("Шаг 3: Загрузка данных в коллекцию")
+        # Шаг 3: Загрузка данных в коллекцию (HNSW-граф строится после загрузки)
+        async with deferred_hnsw_indexing(qdrant_client, collection_name):
+            uploaded = await fill_collection_services(
+                prepend_async(first, batches), collection_name
+            )
+    # upsert идёт с wait=False: ждём, пока Qdrant применит все точки, — сразу
+    # после сборки по коллекции ищут (в т.ч. _match_service_ids по временной)
+    await wait_for_points(qdrant_client, collection_name, uploaded)
 
     logger.info("Шаг 4: Проверка поиска с тестовым запросом")
     # Шаг 4: Проверка поиска с тестовым запросом
@@ -76,87 +92,84 @@ async def qdrant_create_services_async(
 
 
 # -------------------- Загрузка сервисов из Postgres --------------------
-async def services_load_from_postgres(
+def services_load_from_postgres(
     channel_id: int | None = None,
     pool: asyncpg.Pool | None = None,  # type: ignore[type-arg]
-) -> list[dict[str, Any]]:
-    """Загружает сервисы из таблицы services.
+    batch_size: int = EMBED_BATCH_SIZE,
+) -> AsyncGenerator[list[asyncpg.Record], None]:
+    """Читает сервисы из таблицы services батчами по batch_size.
 
-    Если channel_id указан, фильтрует по нему, иначе возвращает все сервисы.
-    Возвращает список словарей с ключами:
+    Если channel_id указан, фильтрует по нему, иначе читает все сервисы.
+    Строки идут серверным курсором; каждая запись — asyncpg.Record с ключами:
     channel_id, id, services_name, description, indications,
     contraindications, pre_session_instructions, body_parts
     """
     assert pool is not None, "pool is required"
-    async with pool.acquire() as conn:
-        if channel_id is not None:
-            rows = await conn.fetch(
-                """
-                SELECT channel_id, id, services_full_name as services_name, description,
-                    indications, contraindications, pre_session_instructions, body_parts
-                FROM services
-                WHERE channel_id = $1
-            """,
-                channel_id,
-            )
-        else:
-            rows = await conn.fetch("""
-                SELECT channel_id, id, services_full_name as services_name, description,
-                    indications, contraindications, pre_session_instructions, body_parts
-                FROM services
-            """)
-        return [dict(r) for r in rows]
+    query = """
+        SELECT channel_id, id, services_full_name as services_name, description,
+            indications, contraindications, pre_session_instructions, body_parts
+        FROM services
+    """
+    if channel_id is not None:
+        return fetch_batches(
+            pool, query + " WHERE channel_id = $1", channel_id, batch_size=batch_size
+        )
+    return fetch_batches(pool, query, batch_size=batch_size)
 
 
 # -------------------- Загрузка сервисов в Qdrant --------------------
+async def _process_batch_services(
+    batch: Sequence[asyncpg.Record], collection_name: str
+) -> int:
+    """Считает эмбеддинги одного батча сервисов и загружает его в Qdrant.
+
+    Возвращает количество загруженных точек.
+    """
+    # Фильтруем записи без названия сервиса
+    filtered = [d for d in batch if (d["services_name"] or "").strip()]
+    if not filtered:
+        return 0
+
+    # Получаем список названий для эмбеддинга
+    names = [d["services_name"] for d in filtered]
+
+    # -------------------- Эмбеддинги --------------------
+    # Sparse BM25 (fastembed, CPU-bound — вне event loop) и dense OpenAI
+    # считаются одновременно
+    bm25_emb, ada_emb = await gather_or_cancel(
+        bm25_passage_embed(names), cached_ada_embeddings(names)
+    )
+
+    # -------------------- Формирование точек для Qdrant --------------------
+    # Точки колонками (models.Batch), без PointStruct на каждую запись; upsert с retry
+    return await upsert_points(
+        collection_name,
+        ids=[int(d["id"]) for d in filtered],  # Используем ID сервиса как идентификатор точки
+        vectors={"ada-embedding": ada_emb, "bm25": bm25_emb},  # Dense и sparse векторы
+        payloads=[dict(d) for d in filtered],  # Сохраняем всю запись сервиса как payload
+    )
+
+
 async def fill_collection_services(
-    docs: list[dict[str, Any]], collection_name: str, batch_size: int = 64
-) -> None:
+    batches: AsyncIterator[Sequence[asyncpg.Record]],
+    collection_name: str,
+    parallel: int = settings.qdrant_upload_parallel,
+) -> int:
     """Загружает сервисы в коллекцию Qdrant.
 
     Для каждого сервиса создаются два типа эмбеддингов:
         - BM25 (sparse)
         - OpenAI ADA (dense)
-    docs: список словарей с сервисами
+    batches: асинхронный поток батчей сервисов (см. services_load_from_postgres)
     collection_name: название коллекции Qdrant
-    batch_size: размер батча для пакетной загрузки
-    """
-    logger.info("qdrant.upload.started", count=len(docs), collection=collection_name)
-
-    # Разбиваем данные на батчи и отображаем прогресс
-    for batch in tqdm_asyncio(
-        batch_iterable(docs, batch_size), desc="Services batches"
-    ):
-        # Фильтруем записи без названия сервиса
-        filtered = [d for d in batch if d.get("services_name", "").strip()]
-        if not filtered:
-            continue
-
-        # Получаем список названий для эмбеддинга
-        names = [d["services_name"] for d in filtered]
-
-        # -------------------- Эмбеддинги --------------------
-        # Sparse BM25 embedding
-        bm25_emb = list(bm25_embedding_model.passage_embed(names))
-        # Dense OpenAI ADA embedding
-        ada_emb = await ada_embeddings(names)
-
-        # -------------------- Формирование точек для Qdrant --------------------
-        points = [
-            models.PointStruct(
-                id=int(d["id"]),  # Используем ID сервиса как идентификатор точки
-                vector={
-                    "ada-embedding": ada_emb[i],  # Dense вектор
-                    "bm25": bm25_emb[i].as_object(),  # Sparse вектор
-                },
-                payload=d,  # Сохраняем всю запись сервиса как payload
-            )
-            for i, d in enumerate(filtered)
-        ]
-
-        # Загружаем точки в коллекцию с retry для надежности
-        await retry_request(
-            qdrant_client.upload_points, collection_name=collection_name, points=points
-        )
-
+    parallel: сколько батчей обрабатывается одновременно
 
+    Возвращает количество загруженных точек.
+    """
+    logger.info("qdrant.upload.started", collection=collection_name)
+    return await run_batches(
+        batches,
+        functools.partial(_process_batch_services, collection_name=collection_name),
+        desc="Services batches",
+        parallel=parallel,
+    )
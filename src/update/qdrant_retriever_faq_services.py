@@ -9,9 +9,10 @@ from ..zena_logging import get_logger  # type: ignore
 
 logger = get_logger()
 from .qdrant_common import (
-    ada_embeddings,  # Функция генерации dense-векторов OpenAI (Ada)
-    bm25_embedding_model,  # Sparse-векторная модель BM25 (fastembed)
+    ADA_SEARCH_PARAMS,  # Поиск по квантованному ada-embedding с rescore
     qdrant_client,  # Асинхронный клиент Qdrant
+    query_ada_embedding,  # Dense-вектор запроса с LRU-кэшем
+    query_bm25,  # Sparse-вектор запроса с LRU-кэшем
     retry_request,  # Обёртка для надёжного выполнения с повторными попытками
 )
 
@@ -103,13 +104,13 @@ async def retriver_hybrid_async(
         # -------------------------------------------------------
         # 1️⃣ Генерация dense-вектора через OpenAI Ada
         # -------------------------------------------------------
-        query_vector = (await ada_embeddings([query]))[0]
+        query_vector = await query_ada_embedding(query)
 
         # -------------------------------------------------------
         # 2️⃣ Генерация sparse-вектора BM25, если включён гибрид
         # -------------------------------------------------------
         if hybrid:
-            query_bm25 = next(bm25_embedding_model.query_embed(query))
+            query_bm25_vector = query_bm25(query)
 
         # -------------------------------------------------------
         # 3️⃣ Формируем фильтр по channel_id (если задан)
@@ -130,9 +131,14 @@ async def retriver_hybrid_async(
         if hybrid:
             # --- Гибридный режим: объединяем Ada и BM25 ---
             prefetch = [
-                models.Prefetch(query=query_vector, using="ada-embedding", limit=limit),
                 models.Prefetch(
-                    query=models.SparseVector(**query_bm25.as_object()),
+                    query=query_vector,
+                    using="ada-embedding",
+                    params=ADA_SEARCH_PARAMS,
+                    limit=limit,
+                ),
+                models.Prefetch(
+                    query=models.SparseVector(**query_bm25_vector),
                     using="bm25",
                     limit=limit,
                 ),
@@ -153,6 +159,7 @@ async def retriver_hybrid_async(
                 collection_name=database_name,
                 query=query_vector,
                 using="ada-embedding",
+                search_params=ADA_SEARCH_PARAMS,
                 query_filter=query_filter,
                 with_payload=True,
                 limit=limit,
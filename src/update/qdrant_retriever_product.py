@@ -1,4 +1,7 @@
 """Модуль в котором реализованы ретриверы по коллекции 'zena2_products_services_view'."""
+import asyncio
+import functools
+import operator
 from typing import Any
 
 from qdrant_client import models
@@ -15,12 +18,15 @@ from qdrant_client.http.models import (
     NestedCondition,
 )
 
+from ..common import gather_or_cancel  # type: ignore
 from ..settings import settings  # type: ignore
 from ..zena_logging import get_logger  # type: ignore
 from .qdrant_common import (
-    ada_embeddings,  # Функция генерации dense-векторов OpenAI (Ada)
-    bm25_embedding_model,  # Sparse-векторная модель BM25 (fastembed)
+    ADA_SEARCH_PARAMS,  # Поиск по квантованному ada-embedding с rescore
     qdrant_client,  # Асинхронный клиент Qdrant
+    query_ada_embedding,  # Dense-вектор запроса с LRU-кэшем
+    query_ada_embeddings,  # Dense-векторы нескольких запросов с LRU-кэшем
+    query_bm25,  # Sparse-вектор запроса с LRU-кэшем
     retry_request,  # Надёжный вызов с повторными попытками
 )
 
@@ -29,6 +35,25 @@ logger = get_logger()
 # -------------------- Конфигурация --------------------
 COLLECTION_NAME = settings.qdrant_collection_products
 
+# Поля карточки продукта, которые берутся из payload как есть
+PRODUCT_CARD_FIELDS = (
+    "product_id",
+    "product_name",
+    "product_type",
+    "body_parts",
+    "indications_key",
+    "contraindications_key",
+    "duration",
+)
+# Извлечение полей одним вызовом itemgetter вместо dict.get на каждый ключ
+_get_card_fields = operator.itemgetter(*PRODUCT_CARD_FIELDS)
+_get_prices = operator.itemgetter("price_min", "price_max")
+_PRODUCT_DEFAULTS: dict[str, Any] = dict.fromkeys(
+    (*PRODUCT_CARD_FIELDS, "price_min", "price_max")
+)
+# Из Qdrant забираем только поля карточки, а не всю строку product_service_view
+PRODUCT_PAYLOAD = models.PayloadSelectorInclude(include=list(_PRODUCT_DEFAULTS))
+
 
 # -------------------- Преобразование точек --------------------
 def points_to_list(points: list[Record] | list[ScoredPoint]) -> list[dict[str, Any]]:
@@ -49,29 +74,22 @@ def points_to_list(points: list[Record] | list[ScoredPoint]) -> list[dict[str, A
 
     result = []
     for p in points:
-        pl = p.payload or {}  # payload — это словарь, сохранённый в точке Qdrant
-        price_min, price_max = pl.get("price_min"), pl.get("price_max")
-
-        # Формируем карточку продукта в удобном формате
-        result.append(
-            {
-                "product_id": pl.get("product_id"),
-                "product_name": pl.get("product_name"),
-                "product_type": pl.get("product_type"),
-                "body_parts": pl.get("body_parts"),
-                "indications_key": pl.get("indications_key"),
-                "contraindications_key": pl.get("contraindications_key"),
-                "duration": pl.get("duration"),
-                # Форматируем цену как диапазон, если min != max
-                "price": (
-                    f"{price_min} руб."
-                    if price_min == price_max
-                    else f"{price_min} - {price_max} руб."
-                )
-                if price_min is not None and price_max is not None
-                else None,
-            }
+        # payload — это словарь, сохранённый в точке Qdrant; недостающие ключи — None
+        pl = {**_PRODUCT_DEFAULTS, **(p.payload or {})}
+        card = dict(zip(PRODUCT_CARD_FIELDS, _get_card_fields(pl)))
+        price_min, price_max = _get_prices(pl)
+
+        # Форматируем цену как диапазон, если min != max
+        card["price"] = (
+            (
+                f"{price_min} руб."
+                if price_min == price_max
+                else f"{price_min} - {price_max} руб."
+            )
+            if price_min is not None and price_max is not None
+            else None
         )
+        result.append(card)
     # logger.info(result)
     return result
 
@@ -158,6 +176,24 @@ def points_to_list(points: list[Record] | list[ScoredPoint]) -> list[dict[str, A
 #     return None
 
 
+# Тип условия фильтра Qdrant
+Condition = (
+    FieldCondition
+    | IsEmptyCondition
+    | IsNullCondition
+    | HasIdCondition
+    | HasVectorCondition
+    | NestedCondition
+    | Filter
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def _match_text(text: str) -> MatchText:
+    """MatchText на термин; частые термины (части тела, типы) переиспользуются."""
+    return MatchText(text=text)
+
+
 def make_filter(
     channel_id: int | None = None,
     indications: list[str] | None = None,
@@ -179,80 +215,58 @@ def make_filter(
     Возвращает:
         models.Filter или None, если фильтры не заданы
     """
-    must: list[
-        FieldCondition
-        | IsEmptyCondition
-        | IsNullCondition
-        | HasIdCondition
-        | HasVectorCondition
-        | NestedCondition
-        | Filter
-    ] = []
-    must_not: list[
-        FieldCondition
-        | IsEmptyCondition
-        | IsNullCondition
-        | HasIdCondition
-        | HasVectorCondition
-        | NestedCondition
-        | Filter
-    ] = []
-    should: list[
-        FieldCondition
-        | IsEmptyCondition
-        | IsNullCondition
-        | HasIdCondition
-        | HasVectorCondition
-        | NestedCondition
-        | Filter
-    ] = []
-
-    if channel_id:
-        must.append(
-            FieldCondition(key="channel_id", match=MatchValue(value=int(channel_id)))
-        )
-
-    if indications:
-        (should if use_should else must).extend(
-            [
-                FieldCondition(key="indications_key", match=MatchText(text=i))
-                for i in indications
-            ]
-        )
-
-    if body_parts:
-        must.extend(
-            [
-                FieldCondition(key="body_parts", match=MatchText(text=b))
-                for b in body_parts
-            ]
-        )
-
-    if product_type:
-        must.extend(
-            [
-                FieldCondition(key="product_type", match=MatchText(text=t))
-                for t in product_type
-            ]
-        )
-
-    if contraindications:
-        must_not.extend(
-            [
-                FieldCondition(key="contraindications_key", match=MatchText(text=c))
-                for c in contraindications
-            ]
-        )
+    must: list[Condition] = (
+        [FieldCondition(key="channel_id", match=MatchValue(value=int(channel_id)))]
+        if channel_id
+        else []
+    )
+    must_not: list[Condition] = []
+    should: list[Condition] = []
+
+    # Поле payload -> (значения, куда добавлять условия MatchText, любое из значений)
+    text_conditions: tuple[tuple[str, list[str] | None, list[Condition], bool], ...] = (
+        ("indications_key", indications, should if use_should else must, False),
+        ("body_parts", body_parts, must, True),
+        ("product_type", product_type, must, True),
+        ("contraindications_key", contraindications, must_not, True),
+    )
+    for key, values, target, any_of in text_conditions:
+        if not values:
+            continue
+        conditions = [FieldCondition(key=key, match=_match_text(v)) for v in values]
+        if any_of and len(conditions) > 1:
+            # Одна дизъюнкция вместо N условий: в must это "хотя бы одно из"
+            # (а не все сразу), в must_not — то же "ни одного из", что и раньше.
+            # MatchAny не подходит: поля текстовые ("лицо, шея"), нужен MatchText
+            target.append(Filter(should=conditions))
+        else:
+            target.extend(conditions)
 
-    if any([must, must_not, should]):
+    if must or must_not or should:
         return Filter(
-            must=must if must else None,
-            must_not=must_not if must_not else None,
-            should=should if should else None,
+            must=must or None,
+            must_not=must_not or None,
+            should=should or None,
         )
     return None
 
 
+def _hybrid_prefetch(
+    qv_ada: list[float], qv_bm25: dict[str, Any], limit: int = 12
+) -> list[models.Prefetch]:
+    """Prefetch для гибридного поиска: кандидаты по Ada и по BM25 для RRF."""
+    return [
+        models.Prefetch(
+            query=qv_ada, using="ada-embedding", params=ADA_SEARCH_PARAMS, limit=limit
+        ),
+        models.Prefetch(
+            query=models.SparseVector(**qv_bm25),
+            using="bm25",
+            limit=limit,
+        ),
+    ]
+
+
 # -------------------- Базовый поиск (только Ada embeddings) --------------------
 async def retriever_product_async(
     query: str | None = None,
@@ -280,14 +294,15 @@ async def retriever_product_async(
         res: list[ScoredPoint] | list[Record]
         if query:
             # Создаём dense-вектор OpenAI Ada
-            query_vector = (await ada_embeddings([query]))[0]
+            query_vector = await query_ada_embedding(query)
 
             # Поиск ближайших точек в Qdrant res: list[ScoredPoint]
             res = await qdrant_client.query_points(
                 collection_name=COLLECTION_NAME,
                 query=query_vector,
                 using="ada-embedding",
-                with_payload=True,
+                search_params=ADA_SEARCH_PARAMS,
+                with_payload=PRODUCT_PAYLOAD,
                 limit=5,
                 query_filter=query_filter,
             )
@@ -296,7 +311,7 @@ async def retriever_product_async(
             res, _ = await qdrant_client.scroll(
                 collection_name=COLLECTION_NAME,
                 scroll_filter=query_filter,
-                with_payload=True,
+                with_payload=PRODUCT_PAYLOAD,
                 limit=5,
             )
         return points_to_list(res)
@@ -340,25 +355,16 @@ async def retriever_product_hybrid_async(
     async def _logic() -> list[dict[str, Any]]:
         if query:
             # --- Генерация векторов ---
-            qv_ada = (await ada_embeddings([query]))[0]
-            qv_bm25 = next(bm25_embedding_model.query_embed(query))
-
-            # --- Настройка prefetch для гибридного поиска ---
-            prefetch = [
-                models.Prefetch(query=qv_ada, using="ada-embedding", limit=12),
-                models.Prefetch(
-                    query=models.SparseVector(**qv_bm25.as_object()),
-                    using="bm25",
-                    limit=12,
-                ),
-            ]
+            qv_ada = await query_ada_embedding(query)
+            qv_bm25 = query_bm25(query)
+
             res: list[ScoredPoint] | list[Record]
             # --- Выполнение гибридного поиска (RRF) ---
             res = await qdrant_client.query_points(
                 collection_name=COLLECTION_NAME,
-                prefetch=prefetch,
+                prefetch=_hybrid_prefetch(qv_ada, qv_bm25),
                 query=models.FusionQuery(fusion=models.Fusion.RRF),
-                with_payload=True,
+                with_payload=PRODUCT_PAYLOAD,
                 query_filter=query_filter,
                 limit=12,
             )
@@ -367,7 +373,7 @@ async def retriever_product_hybrid_async(
             res, _ = await qdrant_client.scroll(
                 collection_name=COLLECTION_NAME,
                 scroll_filter=query_filter,
-                with_payload=True,
+                with_payload=PRODUCT_PAYLOAD,
                 limit=12,
             )
         return points_to_list(res)
@@ -375,3 +381,58 @@ async def retriever_product_hybrid_async(
     return await retry_request(_logic)
 
 
+# -------------------- Гибридный поиск по нескольким запросам --------------------
+async def retriever_product_hybrid_batch_async(
+    channel_id: int,
+    queries: list[str],
+    indications: list[str] | None = None,
+    contraindications: list[str] | None = None,
+    body_parts: list[str] | None = None,
+    product_type: list[str] | None = None,
+) -> list[list[dict[str, Any]]]:
+    """Гибридный поиск сразу по нескольким запросам с общими фильтрами.
+
+    То же, что retriever_product_hybrid_async, но для списка запросов
+    (переформулировки, разные аспекты): векторы берутся из кэша запросов,
+    промахи эмбеддятся одним запросом к OpenAI, BM25 считается вне event loop,
+    а в Qdrant уходит один query_batch_points вместо вызова на каждый запрос.
+
+    Возвращает списки найденных продуктов в порядке непустых запросов.
+    """
+    queries = [q for q in queries if q and q.strip()]
+    if not queries:
+        return []
+
+    query_filter = make_filter(
+        channel_id=channel_id,
+        indications=indications,
+        contraindications=contraindications,
+        body_parts=body_parts,
+        product_type=product_type,
+        use_should=True,
+    )
+
+    async def _logic() -> list[list[dict[str, Any]]]:
+        # --- Генерация векторов для всех запросов ---
+        qv_ada, qv_bm25 = await gather_or_cancel(
+            query_ada_embeddings(queries),
+            asyncio.to_thread(lambda: [query_bm25(q) for q in queries]),
+        )
+
+        # --- Один батч гибридных запросов (RRF) ---
+        responses = await qdrant_client.query_batch_points(
+            collection_name=COLLECTION_NAME,
+            requests=[
+                models.QueryRequest(
+                    prefetch=_hybrid_prefetch(ada, bm25),
+                    query=models.FusionQuery(fusion=models.Fusion.RRF),
+                    filter=query_filter,
+                    with_payload=PRODUCT_PAYLOAD,
+                    limit=12,
+                )
+                for ada, bm25 in zip(qv_ada, qv_bm25)
+            ],
+        )
+        return [points_to_list(r.points) for r in responses]
+
+    return await retry_request(_logic)
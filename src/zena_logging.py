@@ -12,12 +12,15 @@
 В dev: цветной ConsoleRenderer, ПД видны полностью.
 """
 
+import atexit
 import functools
 import logging
 import os
+import queue
 import sys
 import time
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 from typing import Any, AsyncIterator
 
 import structlog
@@ -26,6 +29,9 @@ from structlog.contextvars import bind_contextvars, clear_contextvars  # noqa: F
 # Ключи, содержащие персональные данные — маскируются в prod
 SENSITIVE_KEYS = {"phone", "access_token", "session_id", "email"}
 
+# Фоновый поток, пишущий логи в stdout (создаётся в setup_logging)
+_log_listener: QueueListener | None = None
+
 
 def _mask_pii_processor(
     logger: Any, method: str, event_dict: dict[str, Any]
@@ -67,14 +73,29 @@ def setup_logging() -> None:
     # stdlib root logger по умолчанию WARNING без handlers — это молча проглатывает
     # INFO-события structlog-а. Без этого вызова docker logs покажет только
     # uvicorn access (у него свой handler), а наши log.info(...) будут не видны.
+    # Запись в stdout (синхронный write) выполняет фоновый QueueListener,
+    # обработчик запроса только кладёт запись в очередь.
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+    else:
+        atexit.register(_stop_log_listener)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
     logging.basicConfig(
         level=level,
-        stream=sys.stdout,
+        handlers=[QueueHandler(log_queue)],
         format="%(message)s",
         force=True,
     )
+    _log_listener = QueueListener(log_queue, stream_handler)
+    _log_listener.start()
 
     processors: list[Any] = [
+        # Отбрасываем события ниже уровня до форматирования и рендеринга
+        structlog.stdlib.filter_by_level,
         structlog.contextvars.merge_contextvars,
         structlog.processors.add_log_level,
         structlog.processors.TimeStamper(fmt="iso"),
@@ -86,10 +107,17 @@ def setup_logging() -> None:
     structlog.configure(
         processors=processors,
         logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.stdlib.BoundLogger,
         cache_logger_on_first_use=True,
     )
 
 
+def _stop_log_listener() -> None:
+    """Дописывает оставшиеся в очереди записи при завершении процесса."""
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
 def get_logger(**kwargs: Any) -> structlog.stdlib.BoundLogger:
     """Возвращает bound logger с переданными начальными полями."""
     return structlog.get_logger(**kwargs)